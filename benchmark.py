@@ -0,0 +1,393 @@
+# Autor: Ing. Walter Rodríguez
+# Fecha: 2026-10-18
+# Descripción: Banco de pruebas de rendimiento de main.py sin salir a internet.
+#   Arranca la app Flask (mismo modo de servidor que en producción) en una carpeta temporal,
+#   con edge-tts reemplazado por un TTS falso (MP3 fijo + WordBoundary con retardo configurable)
+#   y un servidor Gemini falso local (ListModels / generateContent, con 404 y 429).
+#   Mide /tts, /adaptar, /inventario/data (libros de 10k-100k filas) y /inventario-media
+#   a distintos niveles de concurrencia y reporta p50 / p99 y peticiones por segundo.
+#
+# Uso:
+#   python benchmark.py                                   (10k filas, concurrencia 1 8 32)
+#   python benchmark.py --rows 10000 100000 --concurrency 1 16 --requests 400
+#   python benchmark.py --json base.json                  (guardar resultados)
+#   python benchmark.py --compare base.json               (exit 1 si hay regresiones)
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+ESCENARIOS = ('tts_miss', 'tts_hit', 'adaptar_miss', 'adaptar_hit',
+              'inventario_page', 'inventario_search', 'media_range')
+_salida = sys.stdout  # los reportes van aquí aunque los print() de la app se silencien
+
+
+def reportar(texto=''):
+    _salida.write(texto + '\n')
+    _salida.flush()
+
+
+# ======== TTS falso (reemplaza edge_tts.Communicate) ========
+# Un frame MPEG-2 Layer III silencioso por palabra y un evento WordBoundary por palabra.
+_FRAME_MP3 = b'\xff\xf3\x44\xc4' + b'\x00' * 140
+
+
+class FakeCommunicate:
+    delay = 0.2  # segundos totales de "síntesis" por texto
+
+    def __init__(self, text, voice='es-DO-RamonaNeural', rate='+0%', boundary='SentenceBoundary', **kwargs):
+        self.text = text
+
+    async def stream(self):
+        palabras = self.text.split() or ['.']
+        offset = 0
+        for palabra in palabras:
+            await asyncio.sleep(self.delay / len(palabras))
+            yield {'type': 'audio', 'data': _FRAME_MP3 * 4}
+            yield {'type': 'WordBoundary', 'offset': offset, 'duration': 3_000_000, 'text': palabra}
+            offset += 4_000_000
+
+
+async def fake_list_voices(connector=None):
+    return [{'ShortName': 'es-DO-RamonaNeural', 'FriendlyName': 'Ramona', 'Locale': 'es-DO', 'Gender': 'Female'},
+            {'ShortName': 'en-US-AriaNeural', 'FriendlyName': 'Aria', 'Locale': 'en-US', 'Gender': 'Female'}]
+
+
+# ======== Gemini falso ========
+# gemini-bench-flash-lite responde 404 (obliga a probar el siguiente modelo, como en producción);
+# gemini-bench-flash responde 429 con probabilidad rate_429 y si no, el texto con una etiqueta.
+class FakeGemini(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    delay = 0.3
+    rate_429 = 0.05
+    MODELOS = ['gemini-bench-flash-lite', 'gemini-bench-flash', 'gemini-bench-pro']
+
+    def log_message(self, *args):
+        pass
+
+    def _responder(self, code, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.split('?')[0].endswith('/models'):
+            return self._responder(200, {"models": [
+                {"name": f"models/{m}", "supportedGenerationMethods": ["generateContent"]} for m in self.MODELOS]})
+        self._responder(404, {"error": {"code": 404, "message": "not found"}})
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        modelo = self.path.split('/models/')[-1].split(':')[0]
+        if modelo not in self.MODELOS or modelo.endswith('-lite'):
+            return self._responder(404, {"error": {"code": 404, "message": f"{modelo} no disponible"}})
+        time.sleep(self.delay)
+        if random.random() < self.rate_429:
+            return self._responder(429, {"error": {"code": 429, "message": "Quota exceeded",
+                                                   "details": [{"retryDelay": "0s"}]}},
+                                   {'Retry-After': '0'})
+        prompt = payload['contents'][0]['parts'][0]['text']
+        texto = prompt.split('Texto a adaptar:\n')[-1]
+        self._responder(200, {"candidates": [{"content": {"parts": [{"text": f"(feliz) {texto}"}]}}]})
+
+
+def iniciar_gemini_falso():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeGemini)
+    threading.Thread(target=server.serve_forever, name='fake-gemini', daemon=True).start()
+    return server
+
+
+# ======== Datos de prueba ========
+def generar_inventario(workdir, filas):
+    """Crea Inventario/Inventario.xlsx con `filas` artículos. Devuelve la ruta."""
+    import pandas as pd
+    rng = random.Random(filas)
+    palabras = ['camisa', 'pantalón', 'zapato', 'gorra', 'bolso', 'reloj', 'lente', 'correa', 'vestido', 'chaqueta']
+    colores = ['rojo', 'azul', 'negro', 'blanco', 'verde', 'café']
+    df = pd.DataFrame({
+        'ID': range(1, filas + 1),
+        'Nombre': [f"{rng.choice(palabras).title()} {rng.choice(colores)} {i}" for i in range(filas)],
+        'Descripción': [f"Artículo de {rng.choice(palabras)} en color {rng.choice(colores)}, talla {rng.randint(1, 44)}"
+                        for _ in range(filas)],
+        'Cantidad': [rng.randint(0, 50) for _ in range(filas)],
+        'Precio': [round(rng.uniform(5, 500), 2) for _ in range(filas)],
+    })
+    path = os.path.join(workdir, 'Inventario', 'Inventario.xlsx')
+    df.to_excel(path, index=False)
+    return path
+
+
+def generar_multimedia(workdir, items=20, video_mb=2):
+    """Carpetas Inventario/<ID>/ con una foto y un video de relleno."""
+    for item_id in range(1, items + 1):
+        carpeta = os.path.join(workdir, 'Inventario', str(item_id))
+        os.makedirs(carpeta, exist_ok=True)
+        with open(os.path.join(carpeta, 'foto.jpg'), 'wb') as fp:
+            fp.write(os.urandom(200 * 1024))
+        with open(os.path.join(carpeta, 'video.mp4'), 'wb') as fp:
+            fp.write(os.urandom(video_mb * 1024 * 1024))
+
+
+# ======== Servidor de la app ========
+def iniciar_app(main):
+    """Sirve main.app en un puerto libre con el mismo modo que run_flask()."""
+    if main.SERVER_MODE == 'waitress':
+        try:
+            from waitress.server import create_server
+        except ImportError:
+            pass
+        else:
+            server = create_server(main.app, host='127.0.0.1', port=0, threads=main.SERVER_POOL_THREADS)
+
+            def servir():
+                server.run()
+                server.task_dispatcher.shutdown()
+
+            hilo = threading.Thread(target=servir, name='bench-app', daemon=True)
+            hilo.start()
+
+            def cerrar():
+                # Corre dentro del bucle de waitress: al vaciar su mapa de sockets run() termina
+                for canal in list(server._map.values()):
+                    if canal is not server and canal is not server.trigger:
+                        canal.close()
+                server.close()
+
+            def detener():
+                # close() desde otro hilo rompe el bucle (OSError: Bad file descriptor)
+                server.trigger.pull_trigger(cerrar)
+                hilo.join(timeout=5)
+
+            return server.effective_port, 'waitress', detener
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, main.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-app', daemon=True).start()
+    return server.server_port, 'werkzeug', server.shutdown
+
+
+# ======== Carga y medición ========
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    orden = sorted(valores)
+    k = (len(orden) - 1) * p / 100
+    f = int(k)
+    c = min(f + 1, len(orden) - 1)
+    return orden[f] + (orden[c] - orden[f]) * (k - f)
+
+
+def ejecutar(base_url, peticion, total, concurrencia):
+    """Lanza `total` peticiones con `concurrencia` hilos. peticion(session, i) -> Response."""
+    import requests
+    local = threading.local()
+    latencias, errores = [], []
+    lock = threading.Lock()
+
+    def una(i):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        t0 = time.perf_counter()
+        try:
+            resp = peticion(session, base_url, i)
+            ok = resp.status_code < 400
+            _ = resp.content
+            detalle = resp.status_code
+        except Exception as e:
+            ok, detalle = False, type(e).__name__
+        ms = (time.perf_counter() - t0) * 1000
+        with lock:
+            latencias.append(ms)
+            if not ok:
+                errores.append(detalle)
+
+    t0 = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrencia) as pool:
+        list(pool.map(una, range(total)))
+    duracion = time.perf_counter() - t0
+    codigos = {}
+    for e in errores:
+        codigos[str(e)] = codigos.get(str(e), 0) + 1
+    return {
+        "requests": total,
+        "errors": len(errores),
+        "error_codes": codigos,
+        "p50_ms": round(percentil(latencias, 50), 1),
+        "p99_ms": round(percentil(latencias, 99), 1),
+        "max_ms": round(max(latencias), 1) if latencias else 0.0,
+        "rps": round(total / duracion, 1) if duracion else 0.0,
+    }
+
+
+def escenarios(run_id, filas):
+    """Funciones de petición por escenario. run_id evita aciertos de caché entre corridas."""
+    def tts_miss(s, base, i):
+        return s.post(f'{base}/tts', json={"text": f"Oferta {run_id} número {i} solo por hoy en el en vivo"})
+
+    def tts_hit(s, base, i):
+        return s.post(f'{base}/tts', json={"text": f"Bienvenidos al en vivo {run_id}"})
+
+    def adaptar_miss(s, base, i):
+        return s.post(f'{base}/adaptar', json={"texto": f"Llévate el artículo {run_id}-{i} con descuento"})
+
+    def adaptar_hit(s, base, i):
+        return s.post(f'{base}/adaptar', json={"texto": f"Gracias por acompañarnos {run_id}"})
+
+    def inventario_page(s, base, i):
+        offset = (i * 997) % max(1, filas - 200)
+        return s.get(f'{base}/inventario/data', params={"offset": offset, "limit": 200,
+                                                        "fields": "ID,Nombre,Cantidad"})
+
+    def inventario_search(s, base, i):
+        termino = ['camisa', 'azul', 'reloj', 'talla 3', 'gorra negro'][i % 5]
+        return s.get(f'{base}/inventario/data', params={"q": termino, "limit": 50, "in_stock": 1})
+
+    def media_range(s, base, i):
+        item_id = i % 20 + 1
+        inicio = (i * 131072) % (1024 * 1024)
+        return s.get(f'{base}/inventario-media/{item_id}/video.mp4',
+                     headers={'Range': f'bytes={inicio}-{inicio + 262143}'})
+
+    return {n: f for n, f in locals().items() if n in ESCENARIOS}
+
+
+def comparar(resultados, base_path, tolerancia):
+    """Compara con una corrida guardada. Devuelve la lista de regresiones."""
+    with open(base_path, 'r', encoding='utf-8') as fp:
+        base = {(r['rows'], r['scenario'], r['concurrency']): r for r in json.load(fp)['results']}
+    regresiones = []
+    for r in resultados:
+        b = base.get((r['rows'], r['scenario'], r['concurrency']))
+        if not b:
+            continue
+        if b['p99_ms'] and r['p99_ms'] > b['p99_ms'] * (1 + tolerancia):
+            regresiones.append(f"{r['scenario']} c={r['concurrency']} filas={r['rows']}: "
+                               f"p99 {b['p99_ms']} -> {r['p99_ms']} ms")
+        if b['rps'] and r['rps'] < b['rps'] * (1 - tolerancia):
+            regresiones.append(f"{r['scenario']} c={r['concurrency']} filas={r['rows']}: "
+                               f"rps {b['rps']} -> {r['rps']}")
+        if r['errors'] > b['errors']:
+            regresiones.append(f"{r['scenario']} c={r['concurrency']} filas={r['rows']}: "
+                               f"errores {b['errors']} -> {r['errors']}")
+    return regresiones
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark de VentasEnVivo con servicios falsos locales")
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000], help="filas del Excel (uno o varios tamaños)")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=200, help="peticiones por escenario y concurrencia")
+    parser.add_argument('--scenarios', nargs='+', choices=ESCENARIOS, default=list(ESCENARIOS))
+    parser.add_argument('--tts-delay', type=float, default=0.2, help="segundos de síntesis falsa por texto")
+    parser.add_argument('--gemini-delay', type=float, default=0.3, help="segundos de respuesta de Gemini falso")
+    parser.add_argument('--gemini-429', type=float, default=0.05, help="probabilidad de 429 en generateContent")
+    parser.add_argument('--json', help="guardar resultados en este archivo")
+    parser.add_argument('--compare', help="comparar con resultados guardados (exit 1 si hay regresiones)")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="margen antes de marcar regresión")
+    parser.add_argument('--verbose', action='store_true', help="mostrar los print() de la app")
+    parser.add_argument('--keep', action='store_true', help="no borrar la carpeta temporal")
+    args = parser.parse_args()
+    json_path = os.path.abspath(args.json) if args.json else None
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+
+    workdir = tempfile.mkdtemp(prefix='ventas-bench-')
+    os.makedirs(os.path.join(workdir, 'Inventario'))
+    gemini = iniciar_gemini_falso()
+    FakeCommunicate.delay = args.tts_delay
+    FakeGemini.delay = args.gemini_delay
+    FakeGemini.rate_429 = args.gemini_429
+
+    # La app se importa desde la carpeta temporal: Inventario/ y custom_avatars.json son relativos
+    os.environ['GEMINI_API_URL'] = f'http://127.0.0.1:{gemini.server_port}/v1beta'
+    os.environ['Google-API-KEY'] = 'bench-key'
+    os.environ.setdefault('HTTP_RETRY_MAX_WAIT', '1')
+    # Cachés en la carpeta temporal desde el import: main.py no toca las del proyecto
+    os.environ['CACHE_DIR'] = os.path.join(workdir, 'cache')
+    os.environ['TTS_CACHE_DIR'] = os.path.join(workdir, 'tts')
+    os.environ.setdefault('TTS_CACHE_MAX_BYTES', str(1 << 34))
+    os.environ.setdefault('TTS_CACHE_MAX_ENTRIES', '1000000')
+    os.environ.setdefault('ADAPT_CACHE_MAX_ENTRIES', '1000000')
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    if not args.verbose:
+        sys.stdout = open(os.devnull, 'w')
+    import edge_tts
+    edge_tts.Communicate = FakeCommunicate
+    edge_tts.list_voices = fake_list_voices
+    import main
+
+    generar_multimedia(workdir)
+    port, modo, detener = iniciar_app(main)
+    base_url = f'http://127.0.0.1:{port}'
+
+    reportar(f"Servidor: {modo} (SERVER_THREADS={main.SERVER_THREADS}, SLOW_ROUTE_MAX={main.SLOW_ROUTE_MAX}) "
+             f"| TTS falso {args.tts_delay}s | Gemini falso {args.gemini_delay}s, 429 {args.gemini_429:.0%}")
+    reportar(f"Carpeta de trabajo: {workdir}")
+    resultados = []
+    run_id = os.urandom(3).hex()
+    try:
+        for filas in args.rows:
+            t0 = time.perf_counter()
+            xlsx = generar_inventario(workdir, filas)
+            generado = time.perf_counter() - t0
+            main.inventory_index = main.InventoryIndex(xlsx, os.path.join(workdir, 'Inventario', '.snapshot.pkl'))
+            t0 = time.perf_counter()
+            main.inventory_index.get()
+            carga = time.perf_counter() - t0
+            reportar()
+            reportar(f"== {filas} filas (Excel generado en {generado:.1f} s, primera carga {carga * 1000:.0f} ms) ==")
+            reportar(f"{'escenario':<18} {'conc':>5} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9} {'req/s':>8} {'errores':>8}")
+            for nombre in args.scenarios:
+                for conc in args.concurrency:
+                    # Textos nuevos por corrida y concurrencia: los *_miss nunca encuentran caché
+                    peticion = escenarios(f'{run_id}-{filas}-{conc}', filas)[nombre]
+                    if nombre.endswith('_hit'):
+                        ejecutar(base_url, peticion, 1, 1)  # calentar la caché
+                    r = ejecutar(base_url, peticion, args.requests, conc)
+                    r.update(rows=filas, scenario=nombre, concurrency=conc)
+                    resultados.append(r)
+                    codigos = ' '.join(f'{k}x{v}' for k, v in r['error_codes'].items())
+                    reportar(f"{nombre:<18} {conc:>5} {r['p50_ms']:>9} {r['p99_ms']:>9} {r['max_ms']:>9} "
+                             f"{r['rps']:>8} {r['errors']:>8} {codigos}")
+    finally:
+        detener()
+        gemini.shutdown()
+        os.chdir(REPO_DIR)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as fp:
+            json.dump({"created_at": time.time(), "server": modo, "args": vars(args), "results": resultados},
+                      fp, ensure_ascii=False, indent=2)
+        reportar(f"\nResultados guardados en {json_path}")
+    if compare_path:
+        regresiones = comparar(resultados, compare_path, args.tolerance)
+        if regresiones:
+            reportar(f"\n⚠️  {len(regresiones)} regresiones frente a {args.compare}:")
+            for linea in regresiones:
+                reportar(f"  - {linea}")
+            return 1
+        reportar(f"\nSin regresiones frente a {args.compare} (tolerancia {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
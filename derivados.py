@@ -0,0 +1,61 @@
+# Autor: Ing. Walter Rodríguez
+# Fecha: 2026-10-18
+# Descripción: Pool de procesos que genera los derivados de la multimedia del inventario
+#   (imágenes reducidas y pósters de video). Las tareas viven fuera de main.py para que el
+#   hijo las encuentre importando este módulo, que no tiene efectos al importarse. Con
+#   "spawn" el hijo también vuelve a importar el script principal como __mp_main__: el
+#   bloque if __name__ == '__main__' de main.py evita que arranque otra vez la app.
+
+import os
+import uuid
+import subprocess
+import concurrent.futures
+import multiprocessing
+
+
+def crear_pool(workers):
+    """ProcessPoolExecutor con procesos "spawn" (mismo comportamiento en Windows y Linux)."""
+    return concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                  mp_context=multiprocessing.get_context('spawn'))
+
+
+def imagen(src, dst, max_size, quality):
+    """Reduce la imagen (lado mayor <= max_size) respetando la orientación
+    EXIF y la guarda como WebP o JPEG según la extensión de dst. Devuelve el tamaño final."""
+    from PIL import Image, ImageOps
+    tmp = f'{dst}.{uuid.uuid4().hex[:8]}.tmp'
+    try:
+        with Image.open(src) as im:
+            im = ImageOps.exif_transpose(im)
+            im.thumbnail((max_size, max_size), Image.LANCZOS)
+            if dst.endswith('.webp'):
+                im.save(tmp, 'WEBP', quality=quality, method=4)
+            else:
+                if 'A' in im.getbands() or 'transparency' in im.info:
+                    raise ValueError("imagen con transparencia (JPEG no la admite)")
+                im.convert('RGB').save(tmp, 'JPEG', quality=quality, optimize=True, progressive=True)
+        os.replace(tmp, dst)
+        return os.path.getsize(dst)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def poster(ffmpeg, src, dst, max_size):
+    """Extrae con ffmpeg un fotograma (segundo 1, o el primero si el video
+    es más corto) como JPEG de lado mayor <= max_size. Devuelve el tamaño final."""
+    tmp = f'{dst}.{uuid.uuid4().hex[:8]}.tmp'
+    scale = f"scale=w='min({max_size},iw)':h='min({max_size},ih)':force_original_aspect_ratio=decrease"
+    try:
+        for inicio in ('1', '0'):
+            subprocess.run([ffmpeg, '-v', 'error', '-y', '-ss', inicio, '-i', src, '-frames:v', '1',
+                            '-vf', scale, '-q:v', '3', '-f', 'image2', '-c:v', 'mjpeg', tmp],
+                           check=True, timeout=120, stdin=subprocess.DEVNULL, capture_output=True,
+                           creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0))
+            if os.path.exists(tmp) and os.path.getsize(tmp) > 0:
+                os.replace(tmp, dst)
+                return os.path.getsize(dst)
+        raise ValueError("ffmpeg no devolvió ningún fotograma")
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
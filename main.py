@@ -6,6 +6,9 @@
 import os
 import sys
 import ctypes
+import time
+
+_ARRANQUE_T0 = time.perf_counter()
 
 # ── Ocultar consola de Windows inmediatamente al arrancar ──────────────────────
 # Esto funciona cuando se lanza con python.exe (no pythonw), evitando la ventana negra.
@@ -19,20 +22,121 @@ if sys.platform == "win32":
         pass  # Si falla, ignora silenciosamente
 
 import ssl
-import requests as req_lib
-from flask import Flask, render_template, request, jsonify, make_response, send_file
+from flask import Flask, render_template, request, jsonify, make_response, send_file, Response, g, has_request_context, abort
+from werkzeug.security import safe_join
 from flask_cors import CORS
 from dotenv import load_dotenv
-import webview
 import threading
 import datetime
 import asyncio
-import edge_tts
+import concurrent.futures
 import tempfile
 import uuid
 import socket
 import json
-import pandas as pd
+import queue
+import re
+import unicodedata
+import hashlib
+import functools
+import importlib
+import itertools
+import pickle
+import shutil
+import multiprocessing
+import struct
+import io
+import mimetypes
+import random
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import derivados  # tareas del pool de procesos (sin efectos al importarse)
+
+
+# ======== Arranque rápido: importaciones diferidas ========
+# Autor: Ing. Walter Rodríguez - 2026-10-18
+# pandas, edge-tts (con aiohttp), pywebview y requests suman más de un segundo de
+# importación en los portátiles del show y ninguno hace falta para levantar el servidor.
+# Cada uno se importa en su primer uso; tras mostrar la ventana, un hilo de precarga
+# importa los que sí se usarán enseguida. /startup devuelve el informe de tiempos.
+class StartupReport:
+    """Marcas de tiempo del arranque en ms desde que empezó a cargarse main.py,
+    más lo que tardó cada importación diferida y en qué hilo ocurrió."""
+
+    def __init__(self, t0):
+        self.t0 = t0
+        self.marks = []     # [(nombre, ms)]
+        self.imports = {}   # módulo -> {"ms", "at_ms", "thread"}
+        self._lock = threading.Lock()
+
+    def _ms(self):
+        return round((time.perf_counter() - self.t0) * 1000, 1)
+
+    def mark(self, name):
+        with self._lock:
+            self.marks.append((name, self._ms()))
+
+    def record_import(self, module, ms):
+        with self._lock:
+            self.imports[module] = {"ms": round(ms, 1), "at_ms": self._ms(),
+                                    "thread": threading.current_thread().name}
+
+    def as_dict(self):
+        with self._lock:
+            return {"marks": dict(self.marks), "imports": dict(self.imports)}
+
+    def stats(self):
+        with self._lock:
+            out = {f"{name}_ms": ms for name, ms in self.marks}
+            out.update({f"import_{m.replace('.', '_')}_ms": v["ms"] for m, v in self.imports.items()})
+            return out
+
+    def log(self, titulo):
+        with self._lock:
+            marcas = ', '.join(f"{name} {ms:.0f} ms" for name, ms in self.marks)
+            imports = ', '.join(f"{m} {v['ms']:.0f} ms ({v['thread']})" for m, v in self.imports.items())
+        print(f"[ARRANQUE] {titulo}: {marcas}")
+        if imports:
+            print(f"[ARRANQUE] Importaciones diferidas: {imports}")
+
+
+startup = StartupReport(_ARRANQUE_T0)
+
+
+class LazyModule:
+    """Sustituto de un módulo pesado: lo importa (una sola vez, con lock) en el primer
+    acceso a un atributo. Se usa igual que el módulo: pd.read_excel(...)."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        """True si el módulo ya está importado, aunque haya sido por otro (aiohttp vía edge_tts)."""
+        return self._module is not None or self._name in sys.modules
+
+    def load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    t0 = time.perf_counter()
+                    module = importlib.import_module(self._name)
+                    startup.record_import(self._name, (time.perf_counter() - t0) * 1000)
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+
+pd = LazyModule('pandas')
+req_lib = LazyModule('requests')
+aiohttp = LazyModule('aiohttp')
+edge_tts = LazyModule('edge_tts')
+webview = LazyModule('webview')
 
 # Archivo para persistir avatares personalizados
 CUSTOM_AVATARS_FILE = 'custom_avatars.json'
@@ -68,16 +172,262 @@ os.makedirs(TTS_DIR, exist_ok=True)
 app = Flask(__name__, static_folder='static')
 CORS(app)
 
+# ======== Modo de servidor y aislamiento de rutas lentas ========
+# Autor: Ing. Walter Rodríguez - 2026-10-18
+# SERVER_MODE=waitress sirve con un pool fijo de SERVER_THREADS hilos (producción);
+# SERVER_MODE=dev usa el servidor de desarrollo de Werkzeug. Las rutas que esperan a la red
+# (Gemini, edge-tts, descargas de avatares) pasan por @slow_route: como mucho SLOW_ROUTE_MAX
+# hilos a la vez, así siempre quedan hilos libres para /inventario-media, /avatares y la API.
+SERVER_MODE = os.getenv('SERVER_MODE', 'waitress').strip().lower()
+SERVER_THREADS = max(2, int(os.getenv('SERVER_THREADS', '16')))
+SLOW_ROUTE_MAX = max(1, int(os.getenv('SLOW_ROUTE_MAX', str(SERVER_THREADS // 2))))
+SLOW_ROUTE_WAIT = float(os.getenv('SLOW_ROUTE_WAIT', '5'))
+
+_slow_route_slots = threading.BoundedSemaphore(SLOW_ROUTE_MAX)
+
+
+def slow_route(view):
+    """Decorador para vistas con E/S de red bloqueante. Si no hay hueco en SLOW_ROUTE_WAIT
+    segundos responde 503 con Retry-After en vez de ocupar otro hilo del servidor.
+    En respuestas por streaming el hueco se libera al terminar de enviar el cuerpo."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not _slow_route_slots.acquire(timeout=SLOW_ROUTE_WAIT):
+            print(f"[SERVIDOR] {request.path}: {SLOW_ROUTE_MAX} peticiones lentas en curso, 503")
+            response = jsonify({"status": "error", "message": "Servidor ocupado, reintenta en unos segundos"})
+            response.status_code = 503
+            response.headers['Retry-After'] = '2'
+            return response
+        try:
+            response = make_response(view(*args, **kwargs))
+        except BaseException:
+            _slow_route_slots.release()
+            raise
+        if response.is_streamed:
+            response.call_on_close(_slow_route_slots.release)
+        else:
+            _slow_route_slots.release()
+        return response
+    return wrapper
+
+
+# ======== Métricas de latencia por endpoint y por etapa ========
+# Autor: Ing. Walter Rodríguez - 2026-10-18
+# Histogramas de duración por endpoint y por etapa (síntesis edge-tts, Gemini por modelo,
+# lectura del Excel, escaneo de carpetas), contadores y el estado de las cachés.
+# /metrics responde en formato Prometheus; /metrics?format=json en JSON.
+# Con SLOW_REQUEST_MS > 0 se imprime cada petición lenta con el desglose de sus etapas.
+METRICS_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', '0'))
+
+
+class Metrics:
+    """Registro de histogramas, contadores y colectores (funciones que devuelven un dict
+    de valores numéricos en el momento de la consulta, p. ej. stats() de una caché)."""
+
+    def __init__(self, prefix, buckets):
+        self.prefix = prefix
+        self.buckets = buckets
+        self._histograms = {}  # (nombre, etiquetas) -> [conteos por bucket, suma, total]
+        self._counters = {}    # (nombre, etiquetas) -> valor
+        self._collectors = {}  # nombre -> función
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        # Etiquetas siempre como texto: status puede llegar como int (200) o str ('error')
+        # y as_prometheus() ordena las claves
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, limit in enumerate(self.buckets):
+                if value <= limit:
+                    h[0][i] += 1
+                    break
+            h[1] += value
+            h[2] += 1
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def collector(self, name, fn):
+        self._collectors[name] = fn
+
+    @contextmanager
+    def stage(self, name, **labels):
+        """Mide una etapa. Dentro de una petición también queda en su desglose (log de lentas)."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            ms = (time.perf_counter() - t0) * 1000
+            self.observe('stage_duration_ms', ms, stage=name, **labels)
+            if has_request_context() and hasattr(g, 'metric_stages'):
+                g.metric_stages.append((name, ms))
+
+    def _collected(self):
+        out = {}
+        for name, fn in list(self._collectors.items()):
+            try:
+                values = fn()
+            except Exception as e:
+                print(f"[METRICAS] Error en colector {name}: {e}")
+                continue
+            out[name] = {k: v for k, v in values.items()
+                         if isinstance(v, (int, float)) and not isinstance(v, bool)}
+        return out
+
+    def as_json(self):
+        with self._lock:
+            histograms = [{"name": n, "labels": dict(l), "count": h[2], "sum_ms": round(h[1], 1),
+                           "avg_ms": round(h[1] / h[2], 1) if h[2] else 0.0,
+                           "buckets": {str(b): c for b, c in zip(self.buckets, h[0]) if c}}
+                          for (n, l), h in self._histograms.items()]
+            counters = [{"name": n, "labels": dict(l), "value": v} for (n, l), v in self._counters.items()]
+        return {"histograms": histograms, "counters": counters, "gauges": self._collected()}
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        items = list(labels) + list(extra)
+        if not items:
+            return ''
+        esc = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+        return '{' + ','.join(f'{k}="{esc(v)}"' for k, v in items) + '}'
+
+    def as_prometheus(self):
+        lines = []
+        with self._lock:
+            histograms = sorted((k, [list(h[0]), h[1], h[2]]) for k, h in self._histograms.items())
+            counters = sorted(self._counters.items())
+        tipos = set()
+        for (name, labels), (counts, total, count) in histograms:
+            metric = f'{self.prefix}_{name}'
+            if metric not in tipos:
+                tipos.add(metric)
+                lines.append(f'# TYPE {metric} histogram')
+            acumulado = 0
+            for limit, c in zip(self.buckets, counts):
+                acumulado += c
+                lines.append(f'{metric}_bucket{self._labels(labels, [("le", limit)])} {acumulado}')
+            lines.append(f'{metric}_bucket{self._labels(labels, [("le", "+Inf")])} {count}')
+            lines.append(f'{metric}_sum{self._labels(labels)} {total:.3f}')
+            lines.append(f'{metric}_count{self._labels(labels)} {count}')
+        for (name, labels), value in counters:
+            metric = f'{self.prefix}_{name}'
+            if metric not in tipos:
+                tipos.add(metric)
+                lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric}{self._labels(labels)} {value}')
+        for group, values in sorted(self._collected().items()):
+            for k, v in sorted(values.items()):
+                metric = f'{self.prefix}_{group}_{k}'
+                lines.append(f'# TYPE {metric} gauge')
+                lines.append(f'{metric} {v}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics('ventas', METRICS_BUCKETS_MS)
+_requests_in_flight = [0]
+metrics.collector('http_server', lambda: {
+    "in_flight": _requests_in_flight[0],
+    "slow_routes_in_use": SLOW_ROUTE_MAX - _slow_route_slots._value,
+    "slow_routes_max": SLOW_ROUTE_MAX,
+})
+
+
+@app.before_request
+def _metrics_start():
+    g.metric_t0 = time.perf_counter()
+    g.metric_stages = []
+    with metrics._lock:
+        _requests_in_flight[0] += 1
+
+
+@app.teardown_request
+def _metrics_end(exc):
+    with metrics._lock:
+        _requests_in_flight[0] -= 1
+
+
+@app.after_request
+def _metrics_observe(response):
+    t0 = g.get('metric_t0')
+    if t0 is None:
+        return response
+    ms = (time.perf_counter() - t0) * 1000
+    endpoint = request.endpoint or 'not_found'
+    metrics.observe('http_request_duration_ms', ms, endpoint=endpoint, method=request.method,
+                    status=response.status_code)
+    if SLOW_REQUEST_MS and ms >= SLOW_REQUEST_MS:
+        detalle = ', '.join(f'{name}={st_ms:.0f}ms' for name, st_ms in g.metric_stages) or 'sin etapas'
+        print(f"[LENTO] {request.method} {request.path} {response.status_code} {ms:.0f} ms ({detalle})")
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Métricas en formato Prometheus (por defecto) o JSON (?format=json)."""
+    if request.args.get('format') == 'json':
+        return jsonify({"status": "ok", **metrics.as_json()})
+    return Response(metrics.as_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+# ======== Entrega de multimedia con caché HTTP ========
+# Autor: Ing. Walter Rodríguez - 2026-10-18
+# Videos de producto y modelos GLB pesan varios MB: se sirven con ETag fuerte, soporte
+# de Range (206, para adelantar videos) y, si la URL trae ?v=<etag>, como inmutables.
+MEDIA_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+_MEDIA_ENDPOINTS = {'serve_avatares', 'serve_inventario_media', 'serve_show_file', 'serve_tts_cache'}
+
+
+def media_version(st):
+    """ETag fuerte de un archivo a partir de su tamaño y mtime (sin leer el contenido)."""
+    return hashlib.sha1(f"{st.st_size}:{st.st_mtime_ns}".encode()).hexdigest()[:16]
+
+
+def send_media(directory, filename):
+    """send_file con ETag fuerte, Range y caché inmutable para URLs versionadas (?v=)."""
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    etag = media_version(os.stat(path))
+    versioned = request.args.get('v') == etag
+    response = send_file(os.path.abspath(path), conditional=True, etag=etag,
+                         max_age=MEDIA_IMMUTABLE_MAX_AGE if versioned else None)
+    if versioned:
+        response.headers['Cache-Control'] = f'public, max-age={MEDIA_IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
 # Servir archivos desde la carpeta 'avatares' fuera de static
-from flask import send_from_directory
 @app.route('/avatares/<path:filename>')
 def serve_avatares(filename):
-    return send_from_directory(MODELS_DIR, filename)
-
-# Deshabilitar cache para que pywebview siempre sirva la versión más reciente
+    # Variante optimizada si existe y está al día (ver AvatarOptimizer); ?raw=1 sirve el original
+    if filename.endswith('.glb') and '/' not in filename and request.args.get('raw') != '1':
+        if avatar_optimizer.path_for(filename):
+            return send_media(AVATAR_OPTIMIZED_DIR, filename)
+    return send_media(MODELS_DIR, filename)
+
+# Deshabilitar cache para que pywebview siempre sirva la versión más reciente (HTML y API).
+# Las respuestas con ETag sí pueden guardarse, pero se revalidan siempre (304 si no cambiaron).
+# La multimedia define su propia política en send_media().
 @app.after_request
 def add_no_cache_headers(response):
-    response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
+    if request.endpoint in _MEDIA_ENDPOINTS:
+        return response
+    if response.headers.get('ETag'):
+        response.headers['Cache-Control'] = 'no-cache'
+    else:
+        response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
     response.headers['Pragma'] = 'no-cache'
     response.headers['Expires'] = '0'
     return response
@@ -97,69 +447,588 @@ def remote_log():
 # ======== Sistema de Inventario Excel ========
 # Autor: Ing. Walter Rodríguez - 2026-02-20
 
+INVENTARIO_XLSX = os.path.join(INVENTARIO_DIR, 'Inventario.xlsx')
+INVENTARIO_SNAPSHOT = os.path.join(INVENTARIO_DIR, '.Inventario.snapshot.pkl')
+
+
+class InventorySnapshot:
+    """Filas del inventario ya convertidas, con sus validadores HTTP."""
+
+    def __init__(self, signature, items):
+        self.signature = signature
+        self.items = items
+        self.etag = hashlib.sha1(repr(signature).encode()).hexdigest()[:16]
+        self.last_modified = datetime.datetime.fromtimestamp(
+            signature[0] / 1e9, tz=datetime.timezone.utc).replace(microsecond=0)
+        self.columns = list(items[0].keys()) if items else []
+        # Índices auxiliares: se construyen una sola vez por versión del Excel
+        self._search_keys = None
+        self._stock = None
+        self._orders = {}
+        self._by_id = None
+
+    @staticmethod
+    def _normalize(value):
+        """Minúsculas y sin tildes, para buscar 'descripcion' y encontrar 'Descripción'."""
+        text = unicodedata.normalize('NFKD', str(value).casefold())
+        return ''.join(c for c in text if not unicodedata.combining(c))
+
+    @staticmethod
+    def _sort_key(value):
+        # Números primero, luego texto; las celdas vacías siempre al final
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return (0, value, '')
+        if value == '':
+            return (2, 0, '')
+        return (1, 0, InventorySnapshot._normalize(value))
+
+    def _search_index(self):
+        if self._search_keys is None:
+            self._search_keys = [
+                self._normalize(f"{it.get('Nombre', '')} {it.get('Descripción', '')}")
+                for it in self.items
+            ]
+        return self._search_keys
+
+    def _stock_index(self):
+        if self._stock is None:
+            stock = []
+            for it in self.items:
+                try:
+                    stock.append(float(it.get('Cantidad') or 0))
+                except (TypeError, ValueError):
+                    stock.append(0.0)
+            self._stock = stock
+        return self._stock
+
+    def _order(self, column, descending):
+        key = (column, descending)
+        if key not in self._orders:
+            positions = sorted(range(len(self.items)),
+                               key=lambda i: self._sort_key(self.items[i].get(column, '')))
+            if descending:
+                # Invertir sin mover las vacías del final
+                filled = [i for i in positions if self.items[i].get(column, '') != '']
+                positions = filled[::-1] + positions[len(filled):]
+            self._orders[key] = positions
+        return self._orders[key]
+
+    def find(self, item_id):
+        """Busca un artículo por su columna ID (comparando como texto)."""
+        if self._by_id is None:
+            self._by_id = {str(it.get('ID')): it for it in self.items}
+        return self._by_id.get(str(item_id))
+
+    def query(self, q='', in_stock=False, sort=None, descending=False, fields=None,
+              offset=0, limit=None):
+        """Filtra, ordena, pagina y proyecta columnas. Devuelve (total_filtrado, filas)."""
+        positions = self._order(sort, descending) if sort else range(len(self.items))
+        if in_stock:
+            stock = self._stock_index()
+            positions = [i for i in positions if stock[i] > 0]
+        if q:
+            needle = self._normalize(q.strip())
+            keys = self._search_index()
+            positions = [i for i in positions if needle in keys[i]]
+        total = len(positions)
+        end = total if limit is None else offset + limit
+        page = [self.items[i] for i in positions[offset:end]]
+        if fields:
+            page = [{f: it.get(f, '') for f in fields} for it in page]
+        return total, page
+
+
+class InventoryIndex:
+    """Índice del Excel de inventario en memoria.
+    Solo se vuelve a leer cuando cambia el mtime o el tamaño del archivo. Además guarda
+    una copia binaria (pickle) junto al Excel para que un arranque en frío no tenga
+    que parsearlo con openpyxl."""
+
+    def __init__(self, excel_path, snapshot_path):
+        self.excel_path = excel_path
+        self.snapshot_path = snapshot_path
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def _signature(self):
+        st = os.stat(self.excel_path)  # FileNotFoundError si no existe
+        return (st.st_mtime_ns, st.st_size)
+
+    def get(self):
+        """Devuelve el InventorySnapshot vigente, recargando solo si el Excel cambió."""
+        signature = self._signature()
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.signature == signature:
+            return snapshot
+        with self._lock:
+            if self._snapshot is None or self._snapshot.signature != signature:
+                self._snapshot = InventorySnapshot(signature, self._load(signature))
+            return self._snapshot
+
+    def _load(self, signature):
+        try:
+            with open(self.snapshot_path, 'rb') as fp:
+                saved = pickle.load(fp)
+            if saved.get('signature') == signature:
+                print(f"[INVENTARIO] {len(saved['items'])} artículos desde la copia binaria")
+                return saved['items']
+        except (OSError, pickle.PickleError, EOFError, AttributeError, KeyError, TypeError):
+            pass
+
+        with metrics.stage('read_excel'):
+            df = pd.read_excel(self.excel_path)
+        # Limpiar NaN para evitar errores en JSON
+        items = df.fillna('').to_dict(orient='records')
+        print(f"[INVENTARIO] {len(items)} artículos leídos de {os.path.basename(self.excel_path)}")
+        try:
+            tmp_path = f'{self.snapshot_path}.{uuid.uuid4().hex[:8]}.tmp'
+            with open(tmp_path, 'wb') as fp:
+                pickle.dump({'signature': signature, 'items': items}, fp, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            print(f"[INVENTARIO] No se pudo guardar la copia binaria: {e}")
+        return items
+
+
+inventory_index = InventoryIndex(INVENTARIO_XLSX, INVENTARIO_SNAPSHOT)
+
+
+INVENTARIO_PAGE_MAX = 1000
+
+
 @app.route('/inventario/data', methods=['GET'])
 def get_inventario_data():
-    """Lee el archivo Inventario/Inventario.xlsx y devuelve las filas.
+    """Devuelve las filas de Inventario/Inventario.xlsx desde el índice en memoria.
     Columnas esperadas: ID, Nombre, Descripción.
+    Parámetros opcionales (sin ninguno se devuelve todo, como antes):
+      offset, limit       → paginación (limit máx. 1000); la respuesta trae next_offset
+      fields=ID,Nombre    → solo esas columnas
+      q=texto             → busca en Nombre y Descripción (sin distinguir tildes/mayúsculas)
+      in_stock=1          → solo artículos con Cantidad > 0
+      sort=Nombre | -Cantidad → orden ascendente o descendente por una columna
+    Responde 304 si el cliente ya tiene la versión vigente (ETag / Last-Modified).
     """
-    excel_path = os.path.join(INVENTARIO_DIR, 'Inventario.xlsx')
-    if not os.path.exists(excel_path):
-        return jsonify({"status": "error", "message": "No se encontró Inventario/Inventario.xlsx"}), 404
-    
     try:
-        df = pd.read_excel(excel_path)
-        # Limpiar NaN para evitar errores en JSON
-        df = df.fillna('')
-        data = df.to_dict(orient='records')
-        return jsonify({"status": "ok", "items": data})
+        snapshot = inventory_index.get()
+    except FileNotFoundError:
+        return jsonify({"status": "error", "message": "No se encontró Inventario/Inventario.xlsx"}), 404
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+    args = request.args
+    try:
+        offset = max(0, int(args.get('offset', 0)))
+        limit = args.get('limit')
+        limit = min(max(1, int(limit)), INVENTARIO_PAGE_MAX) if limit else None
+    except ValueError:
+        return jsonify({"status": "error", "message": "offset y limit deben ser números enteros"}), 400
+
+    sort = args.get('sort', '').strip() or None
+    descending = bool(sort) and sort.startswith('-')
+    if sort:
+        sort = sort.lstrip('-')
+    fields = [f.strip() for f in args.get('fields', '').split(',') if f.strip()] or None
+    unknown = [c for c in (fields or []) + ([sort] if sort else []) if c not in snapshot.columns]
+    if unknown:
+        return jsonify({"status": "error", "message": f"Columnas desconocidas: {', '.join(unknown)}",
+                        "columns": snapshot.columns}), 400
+
+    total, items = snapshot.query(
+        q=args.get('q', ''),
+        in_stock=args.get('in_stock', '').lower() in ('1', 'true', 'si', 'sí'),
+        sort=sort, descending=descending, fields=fields,
+        offset=offset, limit=limit)
+
+    body = {"status": "ok", "items": items, "total": total}
+    if limit is not None:
+        next_offset = offset + len(items)
+        body.update(offset=offset, limit=limit,
+                    next_offset=next_offset if next_offset < total else None)
+
+    response = jsonify(body)
+    query_tag = hashlib.sha1(request.query_string).hexdigest()[:8] if request.query_string else ''
+    response.set_etag(f"{snapshot.etag}{'-' + query_tag if query_tag else ''}")
+    response.last_modified = snapshot.last_modified
+    return response.make_conditional(request)
+
+# ======== Manifiesto multimedia de Inventario/<ID>/ ========
+# Autor: Ing. Walter Rodríguez - 2026-10-18
+# Se escanea el árbol una vez y un hilo vigila el mtime de cada carpeta; las consultas
+# por artículo se responden desde memoria sin tocar el disco.
+MEDIA_IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.gif')
+MEDIA_VIDEO_EXTS = ('.mp4', '.webm', '.mov')
+MEDIA_WATCH_INTERVAL = float(os.getenv('MEDIA_WATCH_INTERVAL', '2'))
+
+
+class MediaManifest:
+    """Manifiesto de imágenes y videos por artículo, invalidado por mtime de carpeta."""
+
+    def __init__(self, root, interval):
+        self.root = root
+        self.interval = interval
+        self.version = 0
+        self._items = {}        # item_id -> [ {name, url, type, mime, size}, ... ]
+        self._dir_mtimes = {}   # item_id -> st_mtime_ns de su carpeta
+        self._stale = set()     # carpetas a reescanear aunque su mtime no cambió
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._watcher = None
+
+    def _scan_folder(self, item_id, folder_path):
+        files = []
+        for entry in sorted(os.scandir(folder_path), key=lambda e: e.name):
+            name = entry.name
+            lower = name.lower()
+            if not entry.is_file() or not lower.endswith(MEDIA_IMAGE_EXTS + MEDIA_VIDEO_EXTS):
+                continue
+            st = entry.stat()
+            version = media_version(st)
+            files.append({
+                "name": name,
+                "url": f"/inventario-media/{item_id}/{name}?v={version}",
+                "type": 'video' if lower.endswith(MEDIA_VIDEO_EXTS) else 'image',
+                "mime": mimetypes.guess_type(name)[0] or 'application/octet-stream',
+                "size": st.st_size,
+                "version": version
+            })
+            media_derivatives.annotate(item_id, files[-1])
+        return files
+
+    def refresh(self):
+        """Reescanea solo las carpetas cuyo mtime cambió. Devuelve True si hubo cambios."""
+        with metrics.stage('media_scan'):
+            if not os.path.isdir(self.root):
+                seen = {}
+            else:
+                seen = {e.name: e.stat().st_mtime_ns for e in os.scandir(self.root)
+                        if e.is_dir() and not e.name.startswith('.')}
+            with self._lock:
+                stale, self._stale = self._stale, set()
+            changed = False
+            items = dict(self._items)
+            for item_id, mtime in seen.items():
+                if self._dir_mtimes.get(item_id) != mtime or item_id in stale:
+                    try:
+                        items[item_id] = self._scan_folder(item_id, os.path.join(self.root, item_id))
+                    except OSError as e:
+                        print(f"[MEDIA] No se pudo leer {item_id}: {e}")
+                        continue
+                    self._dir_mtimes[item_id] = mtime
+                    changed = True
+            for item_id in set(items) - set(seen):
+                items.pop(item_id)
+                self._dir_mtimes.pop(item_id, None)
+                changed = True
+            if changed:
+                with self._lock:
+                    self._items = items
+                    self.version += 1
+            return changed
+
+    def invalidate(self, item_id):
+        """Reescanea la carpeta en la próxima vuelta del vigilante aunque su mtime no
+        haya cambiado (p. ej. al terminar un derivado, que vive fuera de ella)."""
+        with self._lock:
+            self._stale.add(str(item_id))
+
+    def _ensure_watching(self):
+        if self._watcher is not None:
+            return
+        with self._start_lock:
+            if self._watcher is not None:
+                return
+            self.refresh()
+            watcher = threading.Thread(target=self._watch, name='media-manifest', daemon=True)
+            watcher.start()
+            self._watcher = watcher
+
+    def _watch(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"[MEDIA] Error vigilando {self.root}: {e}")
+
+    def files(self, item_id):
+        self._ensure_watching()
+        return self._items.get(str(item_id), [])
+
+    def snapshot(self):
+        self._ensure_watching()
+        with self._lock:
+            return self.version, self._items
+
+
+media_manifest = MediaManifest(INVENTARIO_DIR, MEDIA_WATCH_INTERVAL)
+metrics.collector('media_manifest', lambda: {"version": media_manifest.version,
+                                             "items": len(media_manifest._items)})
+
+
+@app.route('/inventario/manifest', methods=['GET'])
+def get_inventario_manifest():
+    """Manifiesto completo: {item_id: [archivos]} con tipo, mime y tamaño.
+    Responde 304 si el manifiesto no cambió (ETag por versión).
+    Autor: Ing. Walter Rodríguez - 2026-10-18"""
+    version, items = media_manifest.snapshot()
+    response = jsonify({"status": "ok", "version": version, "items": items})
+    response.set_etag(f"media-{version}")
+    return response.make_conditional(request)
+
 @app.route('/inventario/files/<item_id>', methods=['GET'])
 def get_inventario_files(item_id):
-    """Lista imágenes y videos dentro de la carpeta Inventario/{item_id}/.
+    """Lista imágenes y videos dentro de la carpeta Inventario/{item_id}/ (desde el manifiesto).
     """
-    folder_path = os.path.join(INVENTARIO_DIR, str(item_id))
-    if not os.path.exists(folder_path):
-        return jsonify({"status": "ok", "files": []}) # Carpeta vacía o no existe
-    
-    valid_exts = ('.jpg', '.jpeg', '.png', '.gif', '.mp4', '.webm', '.mov')
-    try:
-        files = []
-        for f in sorted(os.listdir(folder_path)):
-            if f.lower().endswith(valid_exts):
-                type = 'video' if f.lower().endswith(('.mp4', '.webm', '.mov')) else 'image'
-                # URL para acceder al archivo via Flask static route
-                url = f"/inventario-media/{item_id}/{f}"
-                files.append({"name": f, "url": url, "type": type})
-        return jsonify({"status": "ok", "files": files})
-    except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 500
+    return jsonify({"status": "ok", "files": media_manifest.files(item_id)})
 
 @app.route('/inventario-media/<path:filename>')
 def serve_inventario_media(filename):
-    """Sirve archivos multimedia desde la carpeta Inventario/.
+    """Sirve archivos multimedia desde la carpeta Inventario/ (ETag, Range y caché por versión).
+    ?variant=display sirve la imagen reducida (el original si aún no existe) y
+    ?variant=poster el póster de un video (404 si no hay).
     """
-    return send_file(os.path.join(INVENTARIO_DIR, filename))
+    variant = request.args.get('variant')
+    if variant in ('display', 'poster'):
+        item_id, _, name = filename.partition('/')
+        path = media_derivatives.path_for(item_id, name, variant)
+        if path:
+            return send_media(MEDIA_DERIVATIVES_DIR, os.path.relpath(path, MEDIA_DERIVATIVES_DIR))
+        if variant == 'poster':
+            abort(404)
+    return send_media(INVENTARIO_DIR, filename)
+
+# ======== Cliente HTTP saliente compartido (Gemini y descargas) ========
+# Autor: Ing. Walter Rodríguez - 2026-10-18
+# Una sola requests.Session para todo lo que sale a internet: conexiones keep-alive
+# reutilizadas (sin handshake TCP+TLS por llamada), tope de conexiones por host,
+# reintentos con espera ante 429/5xx y tiempos por host para diagnóstico.
+HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', '8'))
+HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', '2'))
+HTTP_RETRY_MAX_WAIT = float(os.getenv('HTTP_RETRY_MAX_WAIT', '10'))
+HTTP_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class HttpClient:
+    """requests.Session con pool por host (pool_block: nunca más de pool_maxsize conexiones
+    a un mismo host), reintentos y métricas. verify=False para redes con proxy SSL."""
+
+    def __init__(self, pool_maxsize, retries, max_wait):
+        self.retries = retries
+        self.max_wait = max_wait
+        self.pool_maxsize = pool_maxsize
+        self._session = None  # se crea en la primera petición (importa requests)
+        self._stats = {}  # host -> contadores y tiempos
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    session = req_lib.Session()
+                    session.verify = False
+                    adapter = req_lib.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=self.pool_maxsize,
+                                                           pool_block=True)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+        return self._session
+
+    def request(self, method, url, retry_statuses=HTTP_RETRY_STATUSES, **kwargs):
+        """Como requests.request. Reintenta errores de conexión y los códigos de retry_statuses
+        esperando Retry-After / retryDelay / backoff exponencial; si la espera pedida supera
+        HTTP_RETRY_MAX_WAIT devuelve la respuesta tal cual para que decida quien llama.
+        Con stream=True el tiempo medido es hasta recibir las cabeceras."""
+        kwargs.setdefault('timeout', 30)
+        host = req_lib.utils.urlparse(url).netloc
+        for attempt in range(self.retries + 1):
+            t0 = time.perf_counter()
+            try:
+                resp = self.session.request(method, url, **kwargs)
+            except req_lib.exceptions.ConnectionError:
+                self._record(host, time.perf_counter() - t0, None)
+                if attempt == self.retries:
+                    raise
+                self._record_retry(host)
+                time.sleep(min(self.max_wait, 0.5 * 2 ** attempt))
+                continue
+            except Exception:
+                self._record(host, time.perf_counter() - t0, None)
+                raise
+            self._record(host, time.perf_counter() - t0, resp.status_code)
+            if resp.status_code not in retry_statuses or attempt == self.retries:
+                return resp
+            delay = _retry_delay(resp, attempt)
+            if delay > self.max_wait:
+                return resp
+            resp.close()
+            self._record_retry(host)
+            print(f"[HTTP] {host}: HTTP {resp.status_code}, reintento en {delay:.1f} s")
+            time.sleep(delay)
+        return resp
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def _host_stats(self, host):
+        return self._stats.setdefault(host, {"requests": 0, "errors": 0, "retries": 0,
+                                             "total_ms": 0.0, "max_ms": 0.0, "status": {}})
+
+    def _record(self, host, elapsed, status_code):
+        ms = elapsed * 1000
+        with self._lock:
+            st = self._host_stats(host)
+            st['requests'] += 1
+            st['total_ms'] += ms
+            st['max_ms'] = max(st['max_ms'], ms)
+            if status_code is None:
+                st['errors'] += 1
+            else:
+                st['status'][str(status_code)] = st['status'].get(str(status_code), 0) + 1
 
-@app.route('/adaptar', methods=['POST'])
-def adaptar_texto():
-    """Usa Google Gemini para analizar el texto y agregar expresiones faciales automáticas.
-    Autor: Ing. Walter Rodríguez - 2026-02-20
-    Las expresiones se insertan como etiquetas: (feliz), (triste), (sorpresa), (enojo), (serio), (guiño)
-    """
-    data = request.get_json(silent=True) or {}
-    texto = data.get('texto', '').strip()
-    if not texto:
-        return jsonify({"status": "error", "message": "No se proporcionó texto"}), 400
+    def _record_retry(self, host):
+        with self._lock:
+            self._host_stats(host)['retries'] += 1
 
-    google_api_key = os.getenv('Google-API-KEY', '').strip()
-    if not google_api_key:
-        return jsonify({"status": "error", "message": "Google-API-KEY no configurada en .env"}), 500
+    def stats(self):
+        with self._lock:
+            return {host: {**{k: v for k, v in st.items() if k != 'total_ms'},
+                           "status": dict(st['status']),
+                           "avg_ms": round(st['total_ms'] / st['requests'], 1) if st['requests'] else 0.0,
+                           "max_ms": round(st['max_ms'], 1)}
+                    for host, st in self._stats.items()}
 
-    # ── Expresiones faciales disponibles (ampliadas para mayor realismo) ──────
-    # Autor: Ing. Walter Rodríguez - 2026-02-20
-    prompt = f"""Eres un director de actuación para un avatar 3D hispanohablante.
+
+http_client = HttpClient(HTTP_POOL_MAXSIZE, HTTP_RETRIES, HTTP_RETRY_MAX_WAIT)
+metrics.collector('http_client', lambda: {
+    k: sum(st[k] for st in http_client.stats().values()) for k in ('requests', 'errors', 'retries')})
+
+
+@app.route('/http/stats', methods=['GET'])
+def http_stats():
+    """Métricas del cliente HTTP saliente por host (peticiones, reintentos, tiempos)."""
+    return jsonify({"status": "ok", "pool_maxsize": HTTP_POOL_MAXSIZE, "hosts": http_client.stats()})
+
+
+# ======== Modelos Gemini: descubrimiento con caché y circuito por modelo ========
+# Autor: Ing. Walter Rodríguez - 2026-10-18
+# ListModels se consulta una vez por TTL (no en cada /adaptar). El último modelo que
+# respondió bien se prueba primero, y los que fallan quedan fuera un tiempo.
+GEMINI_API_URL = os.getenv('GEMINI_API_URL', 'https://generativelanguage.googleapis.com/v1beta')
+GEMINI_MODELS_TTL = float(os.getenv('GEMINI_MODELS_TTL', '3600'))
+GEMINI_BREAKER_COOLDOWN = float(os.getenv('GEMINI_BREAKER_COOLDOWN', '300'))
+
+
+class GeminiModels:
+    """Caché de ListModels con TTL, modelo preferido "pegajoso" y circuito abierto por modelo."""
+
+    # Solo modelos que soporten generateContent y no sean de imagen/embedding
+    EXCLUIR = ('image', 'embed', 'aqa', 'retrieval', 'robotics', 'computer-use', 'deep-research')
+
+    def __init__(self, ttl, cooldown):
+        self.ttl = ttl
+        self.cooldown = cooldown
+        self.preferred = None
+        self._key_hash = None
+        self._fetched_at = 0.0
+        self._all = []        # todos los que soportan generateContent (para /test-api)
+        self._usable = []     # filtrados y ordenados por velocidad (para /adaptar)
+        self._open_until = {}  # modelo -> time.monotonic() hasta el que no se usa
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _orden(nombre):
+        # Ordenar: primero flash (más rápido), luego pro
+        if 'flash' in nombre and 'lite' in nombre: return 0
+        if 'flash' in nombre: return 1
+        if 'pro' in nombre: return 2
+        return 3
+
+    def discover(self, key, force=False):
+        """Devuelve (status_code, todos, usables, texto_error). Usa la caché si está vigente."""
+        key_hash = hashlib.sha256(key.encode()).hexdigest()
+        with self._lock:
+            fresh = (self._key_hash == key_hash and self._usable
+                     and time.monotonic() - self._fetched_at < self.ttl)
+            if fresh and not force:
+                return 200, list(self._all), list(self._usable), ''
+
+        with metrics.stage('gemini_list_models'):
+            r = http_client.get(f"{GEMINI_API_URL}/models?key={key}", timeout=15)
+        if r.status_code != 200:
+            return r.status_code, [], [], r.text[:200]
+        todos = [m['name'].replace('models/', '') for m in r.json().get('models', [])
+                 if 'generateContent' in m.get('supportedGenerationMethods', [])]
+        usables = sorted((n for n in todos if not any(x in n for x in self.EXCLUIR)), key=self._orden)
+        with self._lock:
+            if self._key_hash != key_hash:
+                # Otra API key: el historial de salud del modelo no aplica
+                self.preferred = None
+                self._open_until.clear()
+            self._key_hash = key_hash
+            self._fetched_at = time.monotonic()
+            self._all, self._usable = todos, usables
+        print(f"[GEMINI] {len(usables)} modelos utilizables (caché por {self.ttl:.0f} s)")
+        return 200, todos, usables, ''
+
+    def candidates(self, usables):
+        """Orden de prueba: preferido primero, luego el resto sin circuito abierto.
+        Si todos están abiertos se prueban igual (mejor un intento que ninguno)."""
+        now = time.monotonic()
+        with self._lock:
+            healthy = [m for m in usables if self._open_until.get(m, 0) <= now]
+            if self.preferred in healthy:
+                healthy.remove(self.preferred)
+                healthy.insert(0, self.preferred)
+        return healthy or list(usables)
+
+    def record_success(self, modelo):
+        with self._lock:
+            self.preferred = modelo
+            self._open_until.pop(modelo, None)
+
+    def record_failure(self, modelo):
+        with self._lock:
+            self._open_until[modelo] = time.monotonic() + self.cooldown
+            if self.preferred == modelo:
+                self.preferred = None
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "preferred": self.preferred,
+                "models": len(self._usable),
+                "age_s": round(now - self._fetched_at, 1) if self._fetched_at else None,
+                "open_circuits": {m: round(t - now, 1) for m, t in self._open_until.items() if t > now},
+            }
+
+
+gemini_models = GeminiModels(GEMINI_MODELS_TTL, GEMINI_BREAKER_COOLDOWN)
+metrics.collector('gemini_models', lambda: {**gemini_models.stats(),
+                                            "open_circuits": len(gemini_models.stats()['open_circuits'])})
+
+
+def _call_gemini(modelo, key, payload_data):
+    """Llama a un modelo específico de Gemini. Un 429 no se reintenta aquí: quien llama
+    prueba el siguiente modelo o aplica su propia pausa compartida."""
+    url = f"{GEMINI_API_URL}/models/{modelo}:generateContent?key={key}"
+    status = 'error'
+    try:
+        with metrics.stage('gemini_generate', model=modelo):
+            resp = http_client.post(url, json=payload_data, timeout=30, retry_statuses=(500, 502, 503, 504))
+        status = resp.status_code
+        return resp
+    finally:
+        metrics.inc('gemini_requests_total', model=modelo, status=status)
+
+
+# ── Expresiones faciales disponibles (ampliadas para mayor realismo) ──────
+# Autor: Ing. Walter Rodríguez - 2026-02-20
+_PROMPT_DIRECTOR = """Eres un director de actuación para un avatar 3D hispanohablante.
 Tu ÚNICA tarea es insertar etiquetas de expresión facial en el texto, \
 para que el avatar se vea lo más natural y realista posible.
 
@@ -179,42 +1048,204 @@ REGLAS ESTRICTAS:
 3. Si el texto es informativo/neutral, no pongas etiqueta
 4. NO modifiques ninguna palabra del texto original
 5. NO agregues explicaciones, introducciones ni comillas al responder
-6. Responde ÚNICAMENTE el texto con las etiquetas insertadas
+"""
+
+ADAPTAR_PROMPT = _PROMPT_DIRECTOR + """6. Responde ÚNICAMENTE el texto con las etiquetas insertadas
 
 Texto a adaptar:
 {texto}"""
 
-    def _call_gemini(modelo, key, payload_data):
-        """Llama a un modelo específico de Gemini. verify=False para proxy SSL."""
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/{modelo}:generateContent?key={key}"
-        return req_lib.post(url, json=payload_data, timeout=30, verify=False)
+# Variante por lotes: varios textos en una sola llamada, respuesta en JSON
+# Autor: Ing. Walter Rodríguez - 2026-10-18
+ADAPTAR_LOTE_PROMPT = _PROMPT_DIRECTOR + """6. Recibirás VARIOS textos como un arreglo JSON de objetos {{"id", "texto"}}.
+   Adapta cada uno por separado aplicando las reglas anteriores.
+7. Responde ÚNICAMENTE un arreglo JSON con un objeto {{"id", "texto"}} por cada texto recibido,
+   con el mismo "id" y el "texto" con las etiquetas insertadas.
+
+Textos a adaptar:
+{textos}"""
+
+
+
+# ======== Caché de adaptaciones y unión de peticiones repetidas ========
+# Autor: Ing. Walter Rodríguez - 2026-10-18
+# Los mismos textos de producto se adaptan sesión tras sesión: el resultado se guarda
+# en disco por (texto normalizado, versión del prompt) y sobrevive a reinicios.
+CACHE_DIR = os.getenv('CACHE_DIR', os.path.join(BASE_DIR, 'cache'))
+ADAPT_CACHE_FILE = os.path.join(CACHE_DIR, 'adaptaciones.json')
+ADAPT_CACHE_MAX_ENTRIES = int(os.getenv('ADAPT_CACHE_MAX_ENTRIES', '5000'))
+# Segundos que se agrupan las altas antes de reescribir el JSON (una adaptación por lotes
+# inserta cientos seguidas)
+ADAPT_CACHE_FLUSH_DELAY = float(os.getenv('ADAPT_CACHE_FLUSH_DELAY', '2'))
+# Cambiar el prompt cambia la versión y deja fuera las adaptaciones anteriores
+ADAPTAR_PROMPT_VERSION = hashlib.sha256(ADAPTAR_PROMPT.encode('utf-8')).hexdigest()[:12]
+
+
+class AdaptCache:
+    """Resultados de /adaptar persistidos en un JSON (escritura atómica, los más antiguos salen primero).
+    put() solo marca la caché como modificada; el archivo se reescribe una vez por cada
+    ráfaga de altas, flush_delay segundos después de la primera (o al llamar a flush())."""
+
+    def __init__(self, path, max_entries, flush_delay):
+        self.path = path
+        self.max_entries = max_entries
+        self.flush_delay = flush_delay
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self._dirty = False
+        self._timer = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._entries = OrderedDict()
+        try:
+            with open(path, 'r', encoding='utf-8') as fp:
+                self._entries.update(json.load(fp))
+        except (OSError, ValueError):
+            pass
 
-    def _get_available_models(key):
-        """Obtiene la lista de modelos disponibles para esta API key."""
-        url = f"https://generativelanguage.googleapis.com/v1beta/models?key={key}"
-        r = req_lib.get(url, timeout=15, verify=False)
-        if r.status_code != 200:
-            return []
-        data = r.json()
-        # Solo modelos que soporten generateContent y no sean de imagen/embedding
-        excluir = ('image', 'embed', 'aqa', 'retrieval', 'robotics', 'computer-use', 'deep-research')
-        modelos = []
-        for m in data.get('models', []):
-            nombre = m['name'].replace('models/', '')
-            metodos = m.get('supportedGenerationMethods', [])
-            if 'generateContent' in metodos and not any(x in nombre for x in excluir):
-                modelos.append(nombre)
-        # Ordenar: primero flash (más rápido), luego pro
-        def orden(nombre):
-            if 'flash' in nombre and 'lite' in nombre: return 0
-            if 'flash' in nombre: return 1
-            if 'pro' in nombre: return 2
-            return 3
-        modelos.sort(key=orden)
-        return modelos
+    @staticmethod
+    def make_key(texto):
+        normalizado = ' '.join(texto.split())
+        raw = f"{ADAPTAR_PROMPT_VERSION}\n{normalizado}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry)
+
+    def put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+            if self._timer is None:
+                self._timer = threading.Timer(self.flush_delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """Escribe el JSON si hay altas pendientes."""
+        with self._write_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty:
+                    return
+                data = json.dumps(self._entries, ensure_ascii=False)
+                self._dirty = False
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp_path = f'{self.path}.{uuid.uuid4().hex[:8]}.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as fp:
+                    fp.write(data)
+                os.replace(tmp_path, self.path)
+                self.flushes += 1
+            except OSError as e:
+                print(f"[ADAPTAR] No se pudo guardar la caché: {e}")
+                with self._lock:
+                    self._dirty = True
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                    "flushes": self.flushes, "prompt_version": ADAPTAR_PROMPT_VERSION}
+
+
+class SingleFlight:
+    """Une llamadas concurrentes con la misma clave: solo la primera ejecuta fn,
+    las demás esperan y reciben el mismo resultado (o la misma excepción)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> [Event, resultado, excepción]
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = [threading.Event(), None, None]
+        if not leader:
+            call[0].wait()
+        else:
+            try:
+                call[1] = fn()
+            except Exception as e:
+                call[2] = e
+            finally:
+                with self._lock:
+                    self._calls.pop(key, None)
+                call[0].set()
+        if call[2] is not None:
+            raise call[2]
+        return call[1]
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
 
+
+adapt_cache = AdaptCache(ADAPT_CACHE_FILE, ADAPT_CACHE_MAX_ENTRIES, ADAPT_CACHE_FLUSH_DELAY)
+_adapt_flight = SingleFlight()
+metrics.collector('adapt_cache', lambda: {**adapt_cache.stats(), "in_flight": _adapt_flight.in_flight()})
+
+
+@app.route('/adaptar', methods=['POST'])
+@slow_route
+def adaptar_texto():
+    """Usa Google Gemini para analizar el texto y agregar expresiones faciales automáticas.
+    Autor: Ing. Walter Rodríguez - 2026-02-20
+    Las expresiones se insertan como etiquetas: (feliz), (triste), (sorpresa), (enojo), (serio), (guiño)
+    """
+    data = request.get_json(silent=True) or {}
+    texto = data.get('texto', '').strip()
+    if not texto:
+        return jsonify({"status": "error", "message": "No se proporcionó texto"}), 400
+
+    google_api_key = os.getenv('Google-API-KEY', '').strip()
+    if not google_api_key:
+        return jsonify({"status": "error", "message": "Google-API-KEY no configurada en .env"}), 500
+
+    cache_key = adapt_cache.make_key(texto)
+    cached = adapt_cache.get(cache_key)
+    if cached is not None:
+        print(f"[ADAPTAR] Caché ({len(cached['texto_adaptado'])} chars)")
+        return jsonify({"status": "ok", **cached, "cached": True})
+
+    # Peticiones idénticas simultáneas (doble clic) comparten una sola llamada a Gemini
+    result, code = _adapt_flight.do(cache_key, lambda: _adaptar_y_guardar(cache_key, texto, google_api_key))
+    return jsonify(result), code
+
+
+@app.route('/adaptar/cache', methods=['GET'])
+def adaptar_cache_stats():
+    """Estadísticas de la caché de adaptaciones (aciertos, fallos, versión del prompt).
+    Autor: Ing. Walter Rodríguez - 2026-10-18"""
+    return jsonify({"status": "ok", "cache": adapt_cache.stats()})
+
+
+def _adaptar_y_guardar(cache_key, texto, google_api_key):
+    result, code = _adaptar_con_gemini(texto, google_api_key)
+    if result.get('status') == 'ok':
+        adapt_cache.put(cache_key, {"texto_adaptado": result['texto_adaptado'], "modelo": result['modelo']})
+    return result, code
+
+
+def _adaptar_con_gemini(texto, google_api_key):
+    """Inserta las etiquetas de expresión con el primer modelo Gemini que responda.
+    Devuelve (respuesta_json, código_http) con los mismos mensajes de error de siempre."""
     payload = {
-        "contents": [{"parts": [{"text": prompt}]}],
+        "contents": [{"parts": [{"text": ADAPTAR_PROMPT.format(texto=texto)}]}],
         "generationConfig": {"temperature": 0.4, "maxOutputTokens": 2048}
     }
 
@@ -222,11 +1253,11 @@ Texto a adaptar:
         # ── Auto-descubrir modelos disponibles para esta API key ──────────────
         # Autor: Ing. Walter Rodríguez - 2026-02-20
         # Primero consultamos qué modelos tiene disponibles esta key específica
-        modelos_disponibles = _get_available_models(google_api_key)
-        print(f"[ADAPTAR] Modelos disponibles: {modelos_disponibles[:5]}...")
+        # (desde la caché de ListModels; solo va a la red al vencer el TTL)
+        _, _, modelos_disponibles, _ = gemini_models.discover(google_api_key)
 
         if not modelos_disponibles:
-            return jsonify({
+            return {
                 "status": "error",
                 "message": (
                     "🔍 NO SE PUDIERON LISTAR LOS MODELOS\n\n"
@@ -234,28 +1265,35 @@ Texto a adaptar:
                     "Usa el botón '🔍 TEST API GEMINI' para diagnosticar.\n"
                     "Verifica tu conexión a internet."
                 )
-            }), 200
+            }, 200
 
         resp = None
         modelo_usado = None
 
-        for modelo in modelos_disponibles:
+        for modelo in gemini_models.candidates(modelos_disponibles):
             r = _call_gemini(modelo, google_api_key, payload)
             if r.status_code == 200:
                 resp = r
                 modelo_usado = modelo
+                gemini_models.record_success(modelo)
                 print(f"[ADAPTAR] ✓ Usando: {modelo}")
                 break
             elif r.status_code in (404, 400):
+                # 404: el modelo no existe para esta key → fuera un tiempo.
+                # 400 puede ser culpa del texto, así que no abre el circuito.
+                if r.status_code == 404:
+                    gemini_models.record_failure(modelo)
                 print(f"[ADAPTAR] ✗ {modelo} → {r.status_code}")
                 continue
             else:
                 resp = r
+                if r.status_code == 429 or r.status_code >= 500:
+                    gemini_models.record_failure(modelo)
                 print(f"[ADAPTAR] Error {r.status_code} con {modelo}")
                 break
 
         if resp is None:
-            return jsonify({
+            return {
                 "status": "error",
                 "message": (
                     "🔍 NINGÚN MODELO FUNCIONÓ\n\n"
@@ -263,7 +1301,7 @@ Texto a adaptar:
                     "Usa el botón '🔍 TEST API GEMINI' para ver qué modelos tienes disponibles.\n"
                     "Puede ser un problema de cuota o permisos."
                 )
-            }), 200
+            }, 200
 
         # ── Manejo descriptivo de errores por código HTTP ─────────────────────
         if resp.status_code != 200:
@@ -307,23 +1345,24 @@ Texto a adaptar:
                 )
 
             print(f"[ADAPTAR] Error HTTP {resp.status_code}: {err_msg}")
-            return jsonify({"status": "error", "message": msg, "code": resp.status_code}), 200
+            return {"status": "error", "message": msg, "code": resp.status_code}, 200
 
         result = resp.json()
         texto_adaptado = result['candidates'][0]['content']['parts'][0]['text'].strip()
         print(f"[ADAPTAR] OK ({len(texto_adaptado)} chars) via {modelo_usado}")
-        return jsonify({"status": "ok", "texto_adaptado": texto_adaptado, "modelo": modelo_usado})
+        return {"status": "ok", "texto_adaptado": texto_adaptado, "modelo": modelo_usado}, 200
 
     except req_lib.exceptions.Timeout:
         msg = "⏱️ TIEMPO DE ESPERA AGOTADO\n\nGemini no respondió en 30 segundos.\nVerifica tu conexión a internet."
-        return jsonify({"status": "error", "message": msg}), 200
+        return {"status": "error", "message": msg}, 200
 
     except Exception as e:
         print(f"[ADAPTAR] Error inesperado: {e}")
-        return jsonify({"status": "error", "message": f"❌ Error inesperado: {str(e)}"}), 500
+        return {"status": "error", "message": f"❌ Error inesperado: {str(e)}"}, 500
 
 
 @app.route('/test-api', methods=['GET'])
+@slow_route
 def test_api():
     """Endpoint para verificar si la Google-API-KEY funciona y qué modelos tiene disponibles.
     Autor: Ing. Walter Rodríguez - 2026-02-20
@@ -336,26 +1375,24 @@ def test_api():
         })
 
     try:
-        # Listar modelos disponibles para esta API key
-        url = f"https://generativelanguage.googleapis.com/v1beta/models?key={google_api_key}"
-        resp = req_lib.get(url, timeout=15, verify=False)
-
-        if resp.status_code == 200:
-            data = resp.json()
-            modelos = [m['name'].replace('models/', '') for m in data.get('models', [])
-                       if 'generateContent' in m.get('supportedGenerationMethods', [])]
+        # Listar modelos disponibles para esta API key (siempre consulta a Google y
+        # de paso refresca la caché que usa /adaptar)
+        status_code, modelos, _, detalle = gemini_models.discover(google_api_key, force=True)
+
+        if status_code == 200:
             return jsonify({
                 "status": "ok",
                 "key_preview": f"{google_api_key[:8]}...{google_api_key[-4:]}",
                 "modelos_disponibles": modelos,
-                "total": len(modelos)
+                "total": len(modelos),
+                "cache": gemini_models.stats()
             })
-        elif resp.status_code == 400:
+        elif status_code == 400:
             return jsonify({"status": "error", "message": "API Key inválida o mal formada", "http": 400})
-        elif resp.status_code == 403:
+        elif status_code == 403:
             return jsonify({"status": "error", "message": "API Key sin permisos para Gemini API", "http": 403})
         else:
-            return jsonify({"status": "error", "message": f"Error HTTP {resp.status_code}", "detalle": resp.text[:200]})
+            return jsonify({"status": "error", "message": f"Error HTTP {status_code}", "detalle": detalle})
 
     except req_lib.exceptions.Timeout:
         return jsonify({"status": "error", "message": "Timeout: no se pudo conectar con Google en 15 segundos"})
@@ -382,68 +1419,839 @@ def check_models():
     models = [f for f in os.listdir(MODELS_DIR) if f.endswith('.glb')]
     return jsonify({"models": models, "path": "/static/models/"})
 
+# ======== Registro de avatares (catálogo + metadatos en memoria) ========
+# Autor: Ing. Walter Rodríguez - 2026-10-18
+# El catálogo base vive en un solo lugar. custom_avatars.json y la carpeta avatares/ se leen
+# una vez y solo se vuelven a leer si cambia su mtime. Tamaño, hash y morph targets de cada
+# GLB se calculan una vez por versión del archivo. Las escrituras del JSON van con candado y
+# rename atómico para que dos descargas simultáneas no pierdan entradas.
+
+# Parámetros de calidad ARKit+Oculus para ReadyPlayerMe
+AVATAR_MORPH_PARAMS = "?morphTargets=ARKit,Oculus+Visemes,mouthOpen,mouthSmile,eyesClosed,eyesLookUp,eyesLookDown&textureSizeLimit=1024&textureFormat=png&pose=T"
+
+# Catálogo base (IDs verificados con gender)
+# Nota: Los IDs de RPM pueden variar. Si un avatar da 404, usar URL personalizada.
+AVATAR_CATALOG = {
+    'avatar_default': {
+        'name': 'Femenino Realista',
+        'gender': 'F',
+        'url': f"https://models.readyplayer.me/64bfa15f0e72c63d7c3934a6.glb{AVATAR_MORPH_PARAMS}"
+    },
+    'avatar_f2': {
+        'name': 'Mara Femenina',
+        'gender': 'F',
+        'url': f"https://models.readyplayer.me/63bc9cb9c0c20de6c48cd8f8.glb{AVATAR_MORPH_PARAMS}"
+    },
+    'avatar_male': {
+        'name': 'Masculino Realista',
+        'gender': 'M',
+        'url': f"https://models.readyplayer.me/64bfa4a6ce0a8563cd28148e.glb{AVATAR_MORPH_PARAMS}"
+    }
+}
+
+
+def _glb_morph_targets(path):
+    """Nombres de morph targets de un GLB leyendo solo la cabecera y el chunk JSON."""
+    with open(path, 'rb') as fp:
+        header = fp.read(20)
+        if len(header) < 20:
+            return []
+        magic, _, _, json_len, json_type = struct.unpack('<4sIIII', header)
+        if magic != b'glTF' or json_type != _GLB_JSON:
+            return []
+        gltf = json.loads(fp.read(json_len))
+    nombres = set()
+    for mesh in gltf.get('meshes', []):
+        nombres.update((mesh.get('extras') or {}).get('targetNames', []))
+    return sorted(nombres)
+
+
+class AvatarRegistry:
+    """Catálogo (base + personalizados) y listado de la galería cacheados por mtime."""
+
+    def __init__(self, models_dir, custom_file):
+        self.models_dir = models_dir
+        self.custom_file = custom_file
+        self._lock = threading.Lock()
+        self._custom = {}
+        self._custom_mtime = None
+        self._models = {}        # filename -> metadatos (se recalculan si cambia tamaño/mtime)
+        self._listing = None
+        self._listing_key = None
+
+    def _load_custom(self):
+        # Llamar con self._lock tomado
+        try:
+            mtime = os.stat(self.custom_file).st_mtime_ns
+        except OSError:
+            self._custom, self._custom_mtime = {}, None
+            return
+        if mtime != self._custom_mtime:
+            try:
+                with open(self.custom_file, 'r') as fp:
+                    self._custom = json.load(fp)
+            except (OSError, ValueError):
+                self._custom = {}
+            self._custom_mtime = mtime
+
+    def catalog(self):
+        """Catálogo base más los avatares personalizados guardados."""
+        with self._lock:
+            self._load_custom()
+            return {**AVATAR_CATALOG, **self._custom}
+
+    def find_custom_url(self, url):
+        with self._lock:
+            self._load_custom()
+            return next((k for k, v in self._custom.items() if v.get('url') == url), None)
+
+    def add_custom(self, avatar_id, entry):
+        """Agrega un avatar personalizado releyendo el archivo bajo candado (no pisa
+        entradas escritas por otra descarga) y lo publica con rename atómico."""
+        with self._lock:
+            self._load_custom()
+            custom = {**self._custom, avatar_id: entry}
+            tmp_path = f'{self.custom_file}.{uuid.uuid4().hex[:8]}.tmp'
+            with open(tmp_path, 'w') as fp:
+                json.dump(custom, fp, indent=2)
+            os.replace(tmp_path, self.custom_file)
+            self._custom = custom
+            self._custom_mtime = os.stat(self.custom_file).st_mtime_ns
+
+    def _model_info(self, filename):
+        # Llamar con self._lock tomado
+        path = os.path.join(self.models_dir, filename)
+        st = os.stat(path)
+        version = media_version(st)
+        info = self._models.get(filename)
+        if info is None or info['version'] != version:
+            sha = hashlib.sha256()
+            with open(path, 'rb') as fp:
+                for block in iter(lambda: fp.read(1024 * 1024), b''):
+                    sha.update(block)
+            try:
+                morphs = _glb_morph_targets(path)
+            except (OSError, ValueError):
+                morphs = []
+            info = {
+                'version': version,
+                'size': st.st_size,
+                'sha256': sha.hexdigest(),
+                'valid': glb_valido(path),
+                'morph_targets': len(morphs),
+                # TalkingHead necesita blendshapes ARKit (jawOpen...) y visemas Oculus (viseme_aa...)
+                'arkit': 'jawOpen' in morphs,
+                'visemes': 'viseme_aa' in morphs,
+            }
+            self._models[filename] = info
+        return info
+
+    def _mtime(self, path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def listing(self):
+        """Avatares en disco para la galería. Se reconstruye solo si cambia avatares/,
+        avatares/.optimized/ o custom_avatars.json; si no, es una copia de la lista en memoria."""
+        with self._lock:
+            self._load_custom()
+            key = (self._mtime(self.models_dir), self._mtime(AVATAR_OPTIMIZED_DIR), self._custom_mtime)
+            if key != self._listing_key:
+                self._listing = self._build_listing()
+                self._listing_key = key
+            return [dict(a) for a in self._listing]
+
+    def _build_listing(self):
+        # Llamar con self._lock tomado
+        res_list = []
+        if not os.path.exists(self.models_dir):
+            return res_list
+        with metrics.stage('avatar_scan'):
+            filenames = sorted(f for f in os.listdir(self.models_dir) if f.endswith('.glb'))
+        for gone in set(self._models) - set(filenames):
+            del self._models[gone]
+        for filename in filenames:
+            aid = filename[:-4]
+            # Prioridad: catálogo base > custom_avatars.json > nombre derivado del filename
+            info = AVATAR_CATALOG.get(aid) or self._custom.get(aid) or {}
+            try:
+                meta = self._model_info(filename)
+            except OSError:
+                continue  # Borrado mientras listábamos
+            # El ?v= debe ser el del archivo que realmente sirve /avatares (optimizado u original)
+            optimized = avatar_optimizer.path_for(filename)
+            version = media_version(os.stat(optimized)) if optimized else meta['version']
+            avatar_optimizer.ensure(filename)
+            res_list.append({
+                'id': aid,
+                'name': info.get('name', aid.replace('_', ' ').title()),
+                'gender': info.get('gender', 'F'),
+                'path': f'/avatares/{filename}?v={version}',
+                'size': meta['size'],
+                'served_size': os.path.getsize(optimized) if optimized else meta['size'],
+                'optimized': bool(optimized),
+                'sha256': meta['sha256'],
+                'valid': meta['valid'],
+                'morph_targets': meta['morph_targets'],
+                'arkit': meta['arkit'],
+                'visemes': meta['visemes'],
+                'is_local': True
+            })
+        return res_list
+
+
+avatar_registry = AvatarRegistry(MODELS_DIR, CUSTOM_AVATARS_FILE)
+
+
+# ======== Descargas de avatares en segundo plano (reanudables) ========
+# Autor: Ing. Walter Rodríguez - 2026-10-18
+# Los GLB pesan varios MB: se descargan en un pool aparte a <id>.glb.part, reanudando con
+# Range si se cortó, y solo se renombran a <id>.glb cuando la cabecera GLB confirma que
+# el archivo está completo. La galería consulta el progreso en /avatars/downloads.
+AVATAR_DOWNLOAD_WORKERS = int(os.getenv('AVATAR_DOWNLOAD_WORKERS', '3'))
+AVATAR_DOWNLOAD_CHUNK = 1024 * 1024
+AVATAR_DOWNLOAD_ATTEMPTS = 3
+
+
+def glb_valido(path):
+    """True si el archivo es un GLB completo: magic glTF, versión 2 y longitud declarada = tamaño."""
+    try:
+        with open(path, 'rb') as fp:
+            header = fp.read(12)
+        size = os.path.getsize(path)
+    except OSError:
+        return False
+    if len(header) < 12:
+        return False
+    magic, version, length = struct.unpack('<4sII', header)
+    return magic == b'glTF' and version == 2 and length == size
+
+
+class AvatarDownloads:
+    """Gestor de descargas: un trabajo por avatar_id (no se duplica si ya está en curso)."""
+
+    def __init__(self, directory, workers):
+        self.directory = directory
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers,
+                                                           thread_name_prefix='avatar-download')
+        self._jobs = {}  # avatar_id -> estado
+        self._lock = threading.Lock()
+
+    def start(self, avatar_id, name, url):
+        """Encola la descarga y devuelve su estado actual."""
+        with self._lock:
+            job = self._jobs.get(avatar_id)
+            if job is None or job['state'] in ('done', 'error'):
+                job = {"avatar_id": avatar_id, "name": name, "state": 'queued', "bytes": 0,
+                       "total": None, "percent": 0, "resumed_from": 0,
+                       "path": f"/avatares/{avatar_id}.glb", "started_at": time.time()}
+                self._jobs[avatar_id] = job
+                self._pool.submit(self._run, job, url)
+            return dict(job)
+
+    def get(self, avatar_id):
+        with self._lock:
+            job = self._jobs.get(avatar_id)
+            return dict(job) if job else None
+
+    def all(self):
+        with self._lock:
+            return [dict(job) for job in self._jobs.values()]
+
+    def _update(self, job, **kw):
+        with self._lock:
+            job.update(kw)
+            if job.get('total'):
+                job['percent'] = min(100, round(job['bytes'] * 100 / job['total']))
+
+    def _run(self, job, url):
+        target = os.path.join(self.directory, f"{job['avatar_id']}.glb")
+        part = f'{target}.part'
+        try:
+            for attempt in range(AVATAR_DOWNLOAD_ATTEMPTS):
+                try:
+                    self._download(job, url, part)
+                    break
+                except (req_lib.exceptions.ConnectionError, req_lib.exceptions.Timeout,
+                        req_lib.exceptions.ChunkedEncodingError) as e:
+                    if attempt == AVATAR_DOWNLOAD_ATTEMPTS - 1:
+                        raise
+                    print(f"[DOWNLOAD] {job['name']}: corte ({e}), reanudando...")
+                    time.sleep(2 ** attempt)
+            if not glb_valido(part):
+                os.remove(part)
+                raise RuntimeError("El archivo descargado no es un GLB válido o está incompleto")
+            os.replace(part, target)
+            size_mb = os.path.getsize(target) / (1024 * 1024)
+            self._update(job, state='done', percent=100, finished_at=time.time(),
+                         message=f"Descargado ({size_mb:.1f} MB)")
+            print(f"[DOWNLOAD] Completado: {job['name']} ({size_mb:.1f} MB)")
+            avatar_optimizer.ensure(f"{job['avatar_id']}.glb")
+        except Exception as e:
+            print(f"[DOWNLOAD] Error con {job['name']}: {e}")
+            self._update(job, state='error', message=str(e), finished_at=time.time())
+
+    def _download(self, job, url, part):
+        """Descarga (o continúa) url en el archivo .part con escrituras de 1 MB."""
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        print(f"[DOWNLOAD] Descargando '{job['name']}' desde: {url[:70]}"
+              + (f" (reanudando en {offset / (1024 * 1024):.1f} MB)" if offset else "..."))
+        with http_client.get(url, timeout=(15, 60), stream=True, headers=headers) as resp:
+            if resp.status_code == 416 and offset:
+                # El .part ya tiene todo lo que el servidor puede dar
+                self._update(job, state='downloading', bytes=offset, total=offset)
+                return
+            if resp.status_code == 206 and resp.headers.get('Content-Range', '').startswith(f'bytes {offset}-'):
+                mode = 'ab'
+            elif resp.status_code == 200:
+                mode, offset = 'wb', 0  # El servidor no admite Range: empezar de nuevo
+            else:
+                raise RuntimeError(f"Error HTTP {resp.status_code} - Avatar no disponible en la nube. "
+                                   "Usa el creador de avatares en https://readyplayer.me para obtener "
+                                   "tu propio enlace .glb")
+            length = resp.headers.get('Content-Length')
+            total = offset + int(length) if length and length.isdigit() else None
+            self._update(job, state='downloading', bytes=offset, total=total, resumed_from=offset)
+            with open(part, mode, buffering=AVATAR_DOWNLOAD_CHUNK) as fp:
+                for chunk in resp.iter_content(chunk_size=AVATAR_DOWNLOAD_CHUNK):
+                    fp.write(chunk)
+                    offset += len(chunk)
+                    self._update(job, bytes=offset)
+
+
+avatar_downloads = AvatarDownloads(MODELS_DIR, AVATAR_DOWNLOAD_WORKERS)
+
+
+# ======== Optimización de avatares GLB (variante en caché) ========
+# Autor: Ing. Walter Rodríguez - 2026-10-18
+# Tras descargar un avatar se genera avatares/.optimized/<id>.glb: texturas PNG recomprimidas
+# (JPEG si son opacas, PNG optimizado si tienen transparencia; requiere Pillow), bufferViews
+# duplicados unificados y nodos/mallas/accesores/texturas sin uso eliminados. Los morph
+# targets (ARKit / visemas Oculus) se conservan tal cual. /avatares sirve la variante si está
+# al día con el original; ?raw=1 fuerza el archivo descargado.
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+AVATAR_OPTIMIZE = os.getenv('AVATAR_OPTIMIZE', '1') == '1'
+AVATAR_OPTIMIZED_DIR = os.path.join(MODELS_DIR, '.optimized')
+AVATAR_TEXTURE_MAX_SIZE = int(os.getenv('AVATAR_TEXTURE_MAX_SIZE', '1024'))
+AVATAR_JPEG_QUALITY = int(os.getenv('AVATAR_JPEG_QUALITY', '85'))
+_GLB_JSON, _GLB_BIN = 0x4E4F534A, 0x004E4942
+# Extensiones que no referencian accesores ni bufferViews por su cuenta (o que se remapean abajo)
+_GLB_EXTENSIONES_SEGURAS = {'KHR_texture_transform', 'KHR_lights_punctual', 'KHR_mesh_quantization',
+                            'KHR_texture_basisu', 'EXT_texture_webp', 'EXT_texture_avif'}
+
+
+def _leer_glb(path):
+    """Devuelve (gltf_json, bin_chunk) de un GLB 2.0."""
+    with open(path, 'rb') as fp:
+        data = fp.read()
+    magic, version, length = struct.unpack_from('<4sII', data, 0)
+    if magic != b'glTF' or version != 2:
+        raise ValueError("No es un GLB 2.0")
+    gltf, binchunk, offset = None, b'', 12
+    while offset < length:
+        chunk_len, chunk_type = struct.unpack_from('<II', data, offset)
+        chunk = data[offset + 8:offset + 8 + chunk_len]
+        offset += 8 + chunk_len
+        if chunk_type == _GLB_JSON:
+            gltf = json.loads(chunk)
+        elif chunk_type == _GLB_BIN:
+            binchunk = chunk
+    if gltf is None:
+        raise ValueError("GLB sin chunk JSON")
+    return gltf, binchunk
+
+
+def _escribir_glb(path, gltf, binchunk):
+    js = json.dumps(gltf, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    js += b' ' * (-len(js) % 4)
+    binchunk += b'\0' * (-len(binchunk) % 4)
+    total = 12 + 8 + len(js) + (8 + len(binchunk) if binchunk else 0)
+    with open(path, 'wb') as fp:
+        fp.write(struct.pack('<4sII', b'glTF', 2, total))
+        fp.write(struct.pack('<II', len(js), _GLB_JSON))
+        fp.write(js)
+        if binchunk:
+            fp.write(struct.pack('<II', len(binchunk), _GLB_BIN))
+            fp.write(binchunk)
+
+
+def _recomprimir_textura(datos, mime):
+    """PNG -> JPEG (opaca) o PNG optimizado (con alfa), reducida a AVATAR_TEXTURE_MAX_SIZE.
+    Devuelve (bytes, mime) solo si el resultado es más pequeño; si no, None."""
+    if Image is None or mime != 'image/png':
+        return None
+    with Image.open(io.BytesIO(datos)) as img:
+        img.load()
+        if max(img.size) > AVATAR_TEXTURE_MAX_SIZE:
+            img.thumbnail((AVATAR_TEXTURE_MAX_SIZE, AVATAR_TEXTURE_MAX_SIZE), Image.LANCZOS)
+        con_alfa = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+        if con_alfa and img.convert('RGBA').getchannel('A').getextrema()[0] == 255:
+            con_alfa = False  # Canal alfa presente pero totalmente opaco
+        out = io.BytesIO()
+        if con_alfa:
+            img.save(out, 'PNG', optimize=True)
+            nuevo_mime = 'image/png'
+        else:
+            img.convert('RGB').save(out, 'JPEG', quality=AVATAR_JPEG_QUALITY, optimize=True)
+            nuevo_mime = 'image/jpeg'
+    nuevo = out.getvalue()
+    return (nuevo, nuevo_mime) if len(nuevo) < len(datos) else None
+
+
+def _texturas_de(obj):
+    """Índices de textura referenciados en un material (recorre extensiones incluidas)."""
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            if k.endswith('Texture') and isinstance(v, dict) and 'index' in v:
+                yield v['index']
+            yield from _texturas_de(v)
+    elif isinstance(obj, list):
+        for v in obj:
+            yield from _texturas_de(v)
+
+
+def _remapear_texturas(obj, remap):
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            if k.endswith('Texture') and isinstance(v, dict) and 'index' in v:
+                v['index'] = remap[v['index']]
+            _remapear_texturas(v, remap)
+    elif isinstance(obj, list):
+        for v in obj:
+            _remapear_texturas(v, remap)
+
+
+def _compactar(gltf, clave, usados):
+    """Deja en gltf[clave] solo los índices usados y devuelve {índice_viejo: índice_nuevo}."""
+    items = gltf.get(clave, [])
+    conservar = sorted(i for i in usados if i < len(items))
+    remap = {viejo: nuevo for nuevo, viejo in enumerate(conservar)}
+    if clave in gltf:
+        gltf[clave] = [items[i] for i in conservar]
+    return remap
+
+
+def optimizar_glb(src_path, dst_path):
+    """Escribe en dst_path la versión optimizada de src_path. Devuelve un resumen del trabajo."""
+    gltf, binchunk = _leer_glb(src_path)
+    desconocidas = [e for e in gltf.get('extensionsUsed', [])
+                     if not e.startswith('KHR_materials_') and e not in _GLB_EXTENSIONES_SEGURAS]
+    buffers = gltf.get('buffers', [])
+    if len(buffers) > 1 or any('uri' in b for b in buffers) or desconocidas:
+        raise ValueError("GLB con buffers externos o extensiones no soportadas "
+                         f"({', '.join(desconocidas) or 'buffers'}): se deja intacto")
+    resumen = {"texturas": 0, "bufferviews_duplicados": 0, "nodos_eliminados": 0}
+    views = gltf.get('bufferViews', [])
+    datos_view = [binchunk[v.get('byteOffset', 0):v.get('byteOffset', 0) + v['byteLength']] for v in views]
+
+    # 1. Texturas PNG embebidas
+    for img in gltf.get('images', []):
+        if 'bufferView' in img:
+            nuevo = _recomprimir_textura(datos_view[img['bufferView']], img.get('mimeType'))
+            if nuevo:
+                datos_view[img['bufferView']], img['mimeType'] = nuevo
+                resumen['texturas'] += 1
+
+    # 2. bufferViews con el mismo contenido, stride y target -> uno solo
+    canonico, vistos = {}, {}
+    for i, v in enumerate(views):
+        firma = (hashlib.sha1(datos_view[i]).digest(), v.get('byteStride'), v.get('target'))
+        canonico[i] = vistos.setdefault(firma, i)
+    resumen['bufferviews_duplicados'] = sum(1 for i, c in canonico.items() if i != c)
+
+    # 3. Nodos alcanzables desde escenas, skins y animaciones
+    nodos = gltf.get('nodes', [])
+    pila = [n for sc in gltf.get('scenes', []) for n in sc.get('nodes', [])]
+    for skin in gltf.get('skins', []):
+        pila += skin.get('joints', []) + ([skin['skeleton']] if 'skeleton' in skin else [])
+    for anim in gltf.get('animations', []):
+        pila += [ch['target']['node'] for ch in anim.get('channels', []) if 'node' in ch.get('target', {})]
+    vivos = set()
+    while pila:
+        n = pila.pop()
+        if n not in vivos:
+            vivos.add(n)
+            pila += nodos[n].get('children', [])
+    resumen['nodos_eliminados'] = len(nodos) - len(vivos)
+    r_nodos = _compactar(gltf, 'nodes', vivos)
+    for sc in gltf.get('scenes', []):
+        sc['nodes'] = [r_nodos[n] for n in sc.get('nodes', [])]
+    for nodo in gltf.get('nodes', []):
+        if 'children' in nodo:
+            nodo['children'] = [r_nodos[n] for n in nodo['children']]
+    for skin in gltf.get('skins', []):
+        skin['joints'] = [r_nodos[n] for n in skin.get('joints', [])]
+        if 'skeleton' in skin:
+            skin['skeleton'] = r_nodos[skin['skeleton']]
+    for anim in gltf.get('animations', []):
+        for ch in anim.get('channels', []):
+            if 'node' in ch.get('target', {}):
+                ch['target']['node'] = r_nodos[ch['target']['node']]
+
+    # 4. Mallas, skins y cámaras usadas por los nodos que quedan
+    nodos = gltf.get('nodes', [])
+    for clave, campo in (('meshes', 'mesh'), ('skins', 'skin'), ('cameras', 'camera')):
+        remap = _compactar(gltf, clave, {n[campo] for n in nodos if campo in n})
+        for n in nodos:
+            if campo in n:
+                n[campo] = remap[n[campo]]
+
+    # 5. Accesores y materiales (los morph targets de cada primitiva cuentan como usados)
+    primitivas = [p for m in gltf.get('meshes', []) for p in m.get('primitives', [])]
+    acc_usados = set()
+    for p in primitivas:
+        acc_usados.update(p.get('attributes', {}).values())
+        acc_usados.update(a for t in p.get('targets', []) for a in t.values())
+        if 'indices' in p:
+            acc_usados.add(p['indices'])
+    acc_usados.update(s['inverseBindMatrices'] for s in gltf.get('skins', []) if 'inverseBindMatrices' in s)
+    for anim in gltf.get('animations', []):
+        for smp in anim.get('samplers', []):
+            acc_usados.update((smp['input'], smp['output']))
+    r_acc = _compactar(gltf, 'accessors', acc_usados)
+    # KHR_materials_variants: las variantes apuntan a materiales que ninguna primitiva usa
+    # por defecto; también cuentan como usados y sus índices se remapean abajo
+    variantes = [m for p in primitivas
+                 for m in p.get('extensions', {}).get('KHR_materials_variants', {}).get('mappings', [])]
+    r_mat = _compactar(gltf, 'materials', {p['material'] for p in primitivas if 'material' in p}
+                       | {m['material'] for m in variantes})
+    for p in primitivas:
+        p['attributes'] = {k: r_acc[a] for k, a in p.get('attributes', {}).items()}
+        if 'targets' in p:
+            p['targets'] = [{k: r_acc[a] for k, a in t.items()} for t in p['targets']]
+        if 'indices' in p:
+            p['indices'] = r_acc[p['indices']]
+        if 'material' in p:
+            p['material'] = r_mat[p['material']]
+    for m in variantes:
+        m['material'] = r_mat[m['material']]
+    for skin in gltf.get('skins', []):
+        if 'inverseBindMatrices' in skin:
+            skin['inverseBindMatrices'] = r_acc[skin['inverseBindMatrices']]
+    for anim in gltf.get('animations', []):
+        for smp in anim.get('samplers', []):
+            smp['input'], smp['output'] = r_acc[smp['input']], r_acc[smp['output']]
+
+    # 6. Texturas, imágenes y samplers
+    r_tex = _compactar(gltf, 'textures', set(_texturas_de(gltf.get('materials', []))))
+    _remapear_texturas(gltf.get('materials', []), r_tex)
+    texturas = gltf.get('textures', [])
+    # La imagen puede estar en la textura o en una extensión (EXT_texture_webp, KHR_texture_basisu...)
+    con_fuente = [o for t in texturas for o in [t, *t.get('extensions', {}).values()]
+                  if isinstance(o, dict) and 'source' in o]
+    r_img = _compactar(gltf, 'images', {o['source'] for o in con_fuente})
+    r_smp = _compactar(gltf, 'samplers', {t['sampler'] for t in texturas if 'sampler' in t})
+    for o in con_fuente:
+        o['source'] = r_img[o['source']]
+    for t in texturas:
+        if 'sampler' in t:
+            t['sampler'] = r_smp[t['sampler']]
+
+    # 7. bufferViews: referencias al canónico, eliminar los que sobran y re-empaquetar el BIN
+    refs = []
+    for acc in gltf.get('accessors', []):
+        refs.append(acc)
+        sparse = acc.get('sparse')
+        if sparse:
+            refs += [sparse['indices'], sparse['values']]
+    refs += gltf.get('images', [])
+    for obj in refs:
+        if 'bufferView' in obj:
+            obj['bufferView'] = canonico[obj['bufferView']]
+    r_view = _compactar(gltf, 'bufferViews', {o['bufferView'] for o in refs if 'bufferView' in o})
+    nuevo_bin = bytearray()
+    for viejo, nuevo in sorted(r_view.items(), key=lambda kv: kv[1]):
+        nuevo_bin += b'\0' * (-len(nuevo_bin) % 4)
+        v = gltf['bufferViews'][nuevo]
+        v['buffer'], v['byteOffset'], v['byteLength'] = 0, len(nuevo_bin), len(datos_view[viejo])
+        nuevo_bin += datos_view[viejo]
+    for obj in refs:
+        if 'bufferView' in obj:
+            obj['bufferView'] = r_view[obj['bufferView']]
+    if buffers:
+        gltf['buffers'] = [{"byteLength": len(nuevo_bin)}]
+
+    _escribir_glb(dst_path, gltf, bytes(nuevo_bin))
+    return resumen
+
+
+class AvatarOptimizer:
+    """Genera y localiza las variantes optimizadas. Cada variante lleva un <id>.json con la
+    versión (tamaño+mtime) del original del que salió: si el original cambia, se regenera."""
+
+    def __init__(self, source_dir, out_dir):
+        self.source_dir = source_dir
+        self.out_dir = out_dir
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='avatar-optimize')
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def _meta(self, filename):
+        try:
+            with open(os.path.join(self.out_dir, f'{filename}.json'), 'r', encoding='utf-8') as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return None
+
+    def info(self, filename):
+        """Resumen de la variante si está al día con el original, o None."""
+        try:
+            version = media_version(os.stat(os.path.join(self.source_dir, filename)))
+        except OSError:
+            return None
+        meta = self._meta(filename)
+        return meta if meta and meta.get('source_version') == version else None
+
+    def path_for(self, filename):
+        """Ruta de la variante optimizada vigente, o None si hay que servir el original."""
+        meta = self.info(filename)
+        if meta and meta.get('optimized'):
+            path = os.path.join(self.out_dir, filename)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def ensure(self, filename):
+        """Encola la optimización si la variante no existe o quedó vieja."""
+        if not AVATAR_OPTIMIZE or self.info(filename) is not None:
+            return
+        with self._lock:
+            if filename in self._pending:
+                return
+            self._pending.add(filename)
+        self._pool.submit(self._run, filename)
+
+    def _run(self, filename):
+        src = os.path.join(self.source_dir, filename)
+        dst = os.path.join(self.out_dir, filename)
+        tmp = f'{dst}.{uuid.uuid4().hex[:8]}.tmp'
+        try:
+            os.makedirs(self.out_dir, exist_ok=True)
+            st = os.stat(src)
+            t0 = time.perf_counter()
+            meta = {"source_version": media_version(st), "size_in": st.st_size,
+                    "pillow": Image is not None}
+            try:
+                meta.update(optimizar_glb(src, tmp))
+                meta['size_out'] = os.path.getsize(tmp)
+                meta['optimized'] = glb_valido(tmp) and meta['size_out'] < st.st_size
+            except Exception as e:
+                meta.update(optimized=False, message=str(e))
+            if meta['optimized']:
+                os.replace(tmp, dst)
+            else:
+                for path in (tmp, dst):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+            meta['elapsed_ms'] = round((time.perf_counter() - t0) * 1000)
+            meta_tmp = f'{tmp}.json'
+            with open(meta_tmp, 'w', encoding='utf-8') as fp:
+                json.dump(meta, fp, ensure_ascii=False)
+            os.replace(meta_tmp, os.path.join(self.out_dir, f'{filename}.json'))
+            if meta['optimized']:
+                print(f"[AVATAR] {filename} optimizado: {st.st_size / 1048576:.1f} MB -> "
+                      f"{meta['size_out'] / 1048576:.1f} MB ({meta['texturas']} texturas, "
+                      f"{meta['bufferviews_duplicados']} bufferViews duplicados)")
+            else:
+                print(f"[AVATAR] {filename} se sirve sin optimizar ({meta.get('message', 'sin ganancia')})")
+        except Exception as e:
+            print(f"[AVATAR] Error optimizando {filename}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(filename)
+
+
+avatar_optimizer = AvatarOptimizer(MODELS_DIR, AVATAR_OPTIMIZED_DIR)
+if Image is None:
+    print("[AVATAR] Pillow no está instalado: las texturas de los avatares no se recomprimen")
+
+
+# ======== Derivados de la multimedia del inventario (imágenes reducidas y pósters) ========
+# Autor: Ing. Walter Rodríguez - 2026-10-18
+# Las fotos de teléfono pesan varios MB y el panel del en vivo las muestra a unos 300 px.
+# Un pool de procesos genera en Inventario/.derivados/<ID>/ una versión reducida de cada
+# imagen (WebP, o JPEG si Pillow no trae WebP) y, si hay ffmpeg, un póster JPEG por video.
+# La versión del original (tamaño+mtime) va en el nombre del derivado: si el original
+# cambia se genera otro y el viejo se borra. Los originales no se tocan.
+# El pool ("spawn" en todas las plataformas) y sus tareas están en derivados.py.
+MEDIA_DERIVATIVES = os.getenv('MEDIA_DERIVATIVES', '1') == '1'
+MEDIA_DERIVATIVES_DIR = os.path.join(INVENTARIO_DIR, '.derivados')
+MEDIA_DERIVATIVE_WORKERS = int(os.getenv('MEDIA_DERIVATIVE_WORKERS', '2'))
+MEDIA_DISPLAY_MAX_SIZE = int(os.getenv('MEDIA_DISPLAY_MAX_SIZE', '800'))
+MEDIA_DISPLAY_QUALITY = int(os.getenv('MEDIA_DISPLAY_QUALITY', '80'))
+MEDIA_DISPLAY_MIN_BYTES = int(os.getenv('MEDIA_DISPLAY_MIN_BYTES', str(200 * 1024)))
+FFMPEG = os.getenv('FFMPEG_PATH') or shutil.which('ffmpeg')
+
+
+class MediaDerivatives:
+    """Localiza los derivados de la multimedia del inventario y encola los que faltan.
+    El manifiesto llama a annotate() por cada archivo al escanear su carpeta; al terminar
+    un derivado se invalida esa carpeta para que el manifiesto publique la URL nueva."""
+
+    def __init__(self, root, out_dir, workers):
+        self.root = root
+        self.out_dir = out_dir
+        self.workers = workers
+        self.generated = 0
+        self.bytes_saved = 0
+        self._pool = None
+        self._pending = set()  # rutas de derivados en curso
+        self._failed = {}      # ruta -> motivo (no se reintenta hasta que cambie el original)
+        self._display_ext = None
+        self._lock = threading.Lock()
+
+    def display_ext(self):
+        if self._display_ext is None:
+            from PIL import features
+            self._display_ext = 'webp' if features.check('webp') else 'jpg'
+        return self._display_ext
+
+    def kinds_for(self, file):
+        """Derivados que corresponden a un archivo del manifiesto."""
+        if not MEDIA_DERIVATIVES:
+            return ()
+        if file['type'] == 'video':
+            return ('poster',) if FFMPEG else ()
+        # Los GIF pueden ser animados y las imágenes pequeñas ya son ligeras: se sirven tal cual
+        if Image is None or file['name'].lower().endswith('.gif') or file['size'] < MEDIA_DISPLAY_MIN_BYTES:
+            return ()
+        return ('display',)
+
+    def _target(self, item_id, name, version, kind):
+        ext = self.display_ext() if kind == 'display' else 'jpg'
+        return os.path.join(self.out_dir, item_id, f'{name}.{version}.{kind}.{ext}')
+
+    def annotate(self, item_id, file):
+        """Añade display_url / poster_url al archivo si el derivado existe; si falta, lo encola."""
+        for kind in self.kinds_for(file):
+            path = self._target(item_id, file['name'], file['version'], kind)
+            try:
+                st = os.stat(path)
+            except OSError:
+                self._submit(item_id, file, kind, path)
+                continue
+            rel = os.path.relpath(path, self.root).replace(os.sep, '/')
+            file[f'{kind}_url'] = f"/inventario-media/{rel}?v={media_version(st)}"
+
+    def path_for(self, item_id, name, kind):
+        """Ruta del derivado vigente de Inventario/<item_id>/<name>, o None."""
+        src = safe_join(self.root, item_id, name)
+        if src is None or '/' in name or not os.path.isfile(src):
+            return None
+        file = {"name": name, "size": os.path.getsize(src),
+                "type": 'video' if name.lower().endswith(MEDIA_VIDEO_EXTS) else 'image'}
+        if kind not in self.kinds_for(file):
+            return None
+        path = self._target(item_id, name, media_version(os.stat(src)), kind)
+        return path if os.path.isfile(path) else None
+
+    def _submit(self, item_id, file, kind, path):
+        with self._lock:
+            if path in self._pending or path in self._failed:
+                return
+            self._pending.add(path)
+            if self._pool is None:
+                self._pool = derivados.crear_pool(self.workers)
+            pool = self._pool
+        src = os.path.join(self.root, item_id, file['name'])
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if kind == 'poster':
+                future = pool.submit(derivados.poster, FFMPEG, src, path, MEDIA_DISPLAY_MAX_SIZE)
+            else:
+                future = pool.submit(derivados.imagen, src, path, MEDIA_DISPLAY_MAX_SIZE, MEDIA_DISPLAY_QUALITY)
+        except Exception as e:  # BrokenProcessPool si un proceso del pool murió
+            print(f"[MEDIA] No se pudo encolar {item_id}/{file['name']}: {e}")
+            with self._lock:
+                self._pending.discard(path)
+                if self._pool is pool:
+                    self._pool = None
+            return
+        future.add_done_callback(functools.partial(self._done, item_id, file, kind, path, time.perf_counter()))
+
+    def _done(self, item_id, file, kind, path, t0, future):
+        with self._lock:
+            self._pending.discard(path)
+        try:
+            size = future.result()
+        except Exception as e:
+            with self._lock:
+                self._failed[path] = str(e)
+            print(f"[MEDIA] Sin derivado para {item_id}/{file['name']}: {e}")
+            return
+        metrics.observe('stage_duration_ms', (time.perf_counter() - t0) * 1000,
+                        stage='media_derivative', kind=kind)
+        with self._lock:
+            self.generated += 1
+            if kind == 'display':
+                self.bytes_saved += max(0, file['size'] - size)
+        # Derivados de versiones anteriores del mismo original
+        actual = os.path.basename(path)
+        for entry in os.scandir(os.path.dirname(path)):
+            if entry.name != actual and entry.name.startswith(f"{file['name']}.") \
+                    and f'.{kind}.' in entry.name and not entry.name.endswith('.tmp'):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+        media_manifest.invalidate(item_id)
+
+    def stats(self):
+        with self._lock:
+            return {"pending": len(self._pending), "failed": len(self._failed),
+                    "generated": self.generated, "bytes_saved": self.bytes_saved,
+                    "pillow": Image is not None, "ffmpeg": FFMPEG is not None}
+
+
+media_derivatives = MediaDerivatives(INVENTARIO_DIR, MEDIA_DERIVATIVES_DIR, MEDIA_DERIVATIVE_WORKERS)
+metrics.collector('media_derivatives', media_derivatives.stats)
+
+
 @app.route('/download-sample-avatar', methods=['POST'])
 def download_sample_avatar():
     """Descarga modelos GLB compatibles con TalkingHead.
     Autor: Ing. Walter Rodríguez - 2026-02-20
-    Acepta un avatar_id del catálogo O una custom_url directa."""
+    Acepta un avatar_id del catálogo, una lista avatar_ids (en paralelo) O una custom_url directa.
+    La descarga corre en segundo plano: el progreso se consulta en /avatars/downloads/<id>."""
     os.makedirs(MODELS_DIR, exist_ok=True)
-
-    # Parámetros de calidad ARKit+Oculus para ReadyPlayerMe
-    morph_params = "?morphTargets=ARKit,Oculus+Visemes,mouthOpen,mouthSmile,eyesClosed,eyesLookUp,eyesLookDown&textureSizeLimit=1024&textureFormat=png&pose=T"
-
-    # Catálogo base (IDs verificados con gender)
-    # Nota: Los IDs de RPM pueden variar. Si un avatar da 404, usar URL personalizada.
-    catalog = {
-        'avatar_default': {
-            'name': 'Femenino Realista',
-            'gender': 'F',
-            'url': f"https://models.readyplayer.me/64bfa15f0e72c63d7c3934a6.glb{morph_params}"
-        },
-        'avatar_f2': {
-            'name': 'Mara Femenina',
-            'gender': 'F',
-            'url': f"https://models.readyplayer.me/63bc9cb9c0c20de6c48cd8f8.glb{morph_params}"
-        },
-        'avatar_male': {
-            'name': 'Masculino Realista',
-            'gender': 'M',
-            'url': f"https://models.readyplayer.me/64bfa4a6ce0a8563cd28148e.glb{morph_params}"
-        }
-    }
-
-    # Agregar avatares personalizados guardados
-    if os.path.exists(CUSTOM_AVATARS_FILE):
-        try:
-            with open(CUSTOM_AVATARS_FILE, 'r') as f:
-                catalog.update(json.load(f))
-        except:
-            pass
+    catalog = avatar_registry.catalog()
 
     # Leer parámetros de la solicitud
     data = request.get_json(silent=True) or {}
     avatar_id   = data.get('avatar_id', '').strip()
     custom_url  = data.get('custom_url', '').strip()
 
+    # --- Caso C: varios IDs del catálogo a la vez (se descargan en paralelo) ---
+    avatar_ids = data.get('avatar_ids')
+    if isinstance(avatar_ids, list) and avatar_ids:
+        desconocidos = [i for i in avatar_ids if i not in catalog]
+        if desconocidos:
+            return jsonify({"status": "error", "message": f"avatar_id no válido: {', '.join(map(str, desconocidos))}"}), 400
+        return jsonify({"status": "ok", "downloads": [
+            _iniciar_descarga_avatar(i, catalog[i]['name'], catalog[i]['url']) for i in avatar_ids]})
+
     # --- Caso A: URL personalizada enviada directamente ---
     if custom_url:
         # Agregar morphTargets si es RPM sin parámetros
         if 'readyplayer.me' in custom_url and '?' not in custom_url:
-            custom_url += morph_params
+            custom_url += AVATAR_MORPH_PARAMS
+        # La misma URL reutiliza su ID: así un reintento continúa la descarga cortada
+        previo = avatar_registry.find_custom_url(custom_url)
+        if previo:
+            return jsonify(_iniciar_descarga_avatar(previo, catalog[previo].get('name', previo), custom_url))
         uid = uuid.uuid4().hex[:6]
         avatar_id = f'custom_{uid}'
         # Persistir para la galería
-        custom_entry = {avatar_id: {'name': f'Personalizado {uid}', 'gender': 'F', 'url': custom_url}}
-        existing = {}
-        if os.path.exists(CUSTOM_AVATARS_FILE):
-            try:
-                with open(CUSTOM_AVATARS_FILE, 'r') as fp:
-                    existing = json.load(fp)
-            except:
-                pass
-        existing.update(custom_entry)
-        with open(CUSTOM_AVATARS_FILE, 'w') as fp:
-            json.dump(existing, fp, indent=2)
+        avatar_registry.add_custom(avatar_id, {'name': f'Personalizado {uid}', 'gender': 'F', 'url': custom_url})
         download_url = custom_url
         avatar_name = f'Personalizado {uid}'
 
@@ -455,103 +2263,565 @@ def download_sample_avatar():
     else:
         return jsonify({"status": "error", "message": "Debes enviar custom_url o un avatar_id válido."}), 400
 
-    # Ruta destino
+    return jsonify(_iniciar_descarga_avatar(avatar_id, avatar_name, download_url))
+
+
+def _iniciar_descarga_avatar(avatar_id, avatar_name, download_url):
+    """Respuesta de /download-sample-avatar: state 'done' si ya está en disco,
+    si no encola la descarga y devuelve su progreso (consultar /avatars/downloads/<id>)."""
     target_file = os.path.join(MODELS_DIR, f'{avatar_id}.glb')
 
-    # No re-descargar si ya existe y es válido
-    if os.path.exists(target_file) and os.path.getsize(target_file) > 100_000:
+    # No re-descargar si ya existe y el GLB está completo
+    if glb_valido(target_file):
         size_mb = os.path.getsize(target_file) / (1024 * 1024)
         print(f"[DOWNLOAD] {avatar_name} ya existe ({size_mb:.1f} MB), omitiendo.")
-        return jsonify({"status": "ok", "message": f"Ya descargado ({size_mb:.1f} MB)", "path": f"/avatares/{avatar_id}.glb", "avatar_id": avatar_id})
+        return {"status": "ok", "state": "done", "message": f"Ya descargado ({size_mb:.1f} MB)",
+                "path": f"/avatares/{avatar_id}.glb", "avatar_id": avatar_id}
 
-    # Descargar
-    try:
-        print(f"[DOWNLOAD] Descargando '{avatar_name}' desde: {download_url[:70]}...")
-        resp = req_lib.get(download_url, timeout=90, stream=True, verify=False)
-        if resp.status_code == 200:
-            with open(target_file, 'wb') as fp:
-                for chunk in resp.iter_content(chunk_size=8192):
-                    fp.write(chunk)
-            size_mb = os.path.getsize(target_file) / (1024 * 1024)
-            print(f"[DOWNLOAD] Completado: {avatar_name} ({size_mb:.1f} MB)")
-            return jsonify({"status": "ok", "message": f"Descargado ({size_mb:.1f} MB)", "path": f"/avatares/{avatar_id}.glb", "avatar_id": avatar_id})
-        else:
-            return jsonify({"status": "error", "message": f"Error HTTP {resp.status_code} - Avatar no disponible en la nube. Usa el creador de avatares en https://readyplayer.me para obtener tu propio enlace .glb"})
-    except Exception as e:
-        return jsonify({"status": "error", "message": str(e)})
+    job = avatar_downloads.start(avatar_id, avatar_name, download_url)
+    return {"status": "ok", **job, "progress_url": f"/avatars/downloads/{avatar_id}"}
+
+
+@app.route('/avatars/downloads', methods=['GET'])
+def avatar_downloads_status():
+    """Progreso de todas las descargas de avatares de esta sesión."""
+    return jsonify({"status": "ok", "downloads": avatar_downloads.all()})
+
+
+@app.route('/avatars/downloads/<avatar_id>', methods=['GET'])
+def avatar_download_status(avatar_id):
+    """Progreso de la descarga de un avatar (bytes, total, percent, state)."""
+    job = avatar_downloads.get(avatar_id)
+    if job is None:
+        if glb_valido(os.path.join(MODELS_DIR, f'{avatar_id}.glb')):
+            return jsonify({"status": "ok", "avatar_id": avatar_id, "state": "done", "percent": 100,
+                            "path": f"/avatares/{avatar_id}.glb"})
+        return jsonify({"status": "error", "message": f"Sin descarga para {avatar_id}"}), 404
+    return jsonify({"status": "ok", **job})
 
 @app.route('/avatars')
 def list_avatars():
     """Lista SOLO los avatares descargados en la carpeta local 'avatares/'.
     Autor: Ing. Walter Rodríguez - 2026-02-20
-    Cambio: eliminado catálogo nube. Solo muestra lo que hay en disco."""
+    Cambio: eliminado catálogo nube. Solo muestra lo que hay en disco.
+    Los datos salen de avatar_registry (se recalculan solo si cambian los archivos)."""
+    res_list = avatar_registry.listing()
+    return jsonify({"status": "ok", "avatars": res_list})
+
 
-    # Cargar metadatos de avatares personalizados (nombre, género guardados al descargar)
-    metadata = {}
-    if os.path.exists(CUSTOM_AVATARS_FILE):
+# ======== Bucle asyncio compartido para edge-tts ========
+# Autor: Ing. Walter Rodríguez - 2026-10-18
+# Un único hilo con un bucle asyncio persistente atiende todas las llamadas a edge-tts.
+# Evita crear/cerrar un event loop y un conector aiohttp por petición y permite que
+# varias síntesis avancen a la vez sin ocupar un hilo WSGI cada una.
+TTS_TIMEOUT = float(os.getenv('TTS_TIMEOUT', '60'))
+TTS_MAX_CONCURRENCY = int(os.getenv('TTS_MAX_CONCURRENCY', '8'))
+
+
+@functools.lru_cache(maxsize=None)
+def _shared_connector_class():
+    """La clase se define en el primer uso para no importar aiohttp al arrancar."""
+
+    class _SharedConnector(aiohttp.TCPConnector):
+        """edge-tts abre su propia ClientSession en cada llamada y, al cerrarla, cerraría
+        también el conector. Este conector ignora esos cierres para conservar la caché
+        DNS y las conexiones keep-alive mientras viva el proceso."""
+
+        def close(self, *args, **kwargs):
+            fut = self._loop.create_future()
+            fut.set_result(None)
+            return fut
+
+    return _SharedConnector
+
+
+class AsyncWorker:
+    """Hilo de fondo con un bucle asyncio de larga vida.
+    Los handlers de Flask envían corrutinas con submit(coro, timeout) y esperan el resultado."""
+
+    def __init__(self, name, max_concurrency):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self._loop = None
+        self._thread = None
+        self._connector = None
+        self._semaphore = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    ready = threading.Event()
+
+                    def run():
+                        asyncio.set_event_loop(loop)
+                        loop.call_soon(ready.set)
+                        loop.run_forever()
+
+                    self._thread = threading.Thread(target=run, name=self.name, daemon=True)
+                    self._thread.start()
+                    ready.wait()
+                    self._loop = loop
+        return self._loop
+
+    def submit(self, coro, timeout=None):
+        """Ejecuta la corrutina en el bucle compartido y bloquea hasta su resultado.
+        Si se agota el tiempo, la cancela y lanza TimeoutError."""
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
         try:
-            with open(CUSTOM_AVATARS_FILE, 'r') as f:
-                metadata = json.load(f)
-        except:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise TimeoutError(f"{self.name}: sin respuesta en {timeout:g} s")
+
+    def connector(self):
+        """Conector aiohttp reutilizado entre llamadas. Solo dentro del bucle."""
+        if self._connector is None or self._connector.closed:
+            self._connector = _shared_connector_class()(limit=self.max_concurrency * 2, ttl_dns_cache=300)
+        return self._connector
+
+    def limit(self):
+        """Semáforo que acota cuántas síntesis corren a la vez. Solo dentro del bucle."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+
+tts_worker = AsyncWorker('edge-tts-loop', TTS_MAX_CONCURRENCY)
+
+
+# ======== Caché de audio TTS (direccionado por contenido) ========
+# Autor: Ing. Walter Rodríguez - 2026-10-18
+# El mismo guion de producto se repite en cada vuelta del en vivo: guardamos el MP3
+# bajo el hash de (texto, voz, velocidad) y lo reutilizamos sin volver a llamar a edge-tts.
+TTS_CACHE_DIR = os.getenv('TTS_CACHE_DIR', os.path.join(TTS_DIR, 'cache'))
+TTS_CACHE_MAX_BYTES = int(os.getenv('TTS_CACHE_MAX_BYTES', str(200 * 1024 * 1024)))
+TTS_CACHE_MAX_ENTRIES = int(os.getenv('TTS_CACHE_MAX_ENTRIES', '500'))
+
+
+class TTSCache:
+    """Caché persistente de audios TTS con expulsión LRU por bytes y por número de entradas.
+    Cada entrada es <key>.mp3 más <key>.json con los tiempos de palabra (WordBoundary).
+    El orden LRU se reconstruye al arrancar a partir del mtime de cada archivo,
+    que se actualiza en cada acierto."""
+
+    def __init__(self, directory, max_bytes, max_entries):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> tamaño en bytes (más antiguo primero)
+        self._total_bytes = 0
+        self._key_locks = {}  # key -> [lock, usuarios] para no sintetizar dos veces lo mismo
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def make_key(text, voice, rate):
+        raw = json.dumps([text, voice, rate], ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+    def path_for(self, key):
+        return os.path.join(self.directory, f'{key}.mp3')
+
+    def url_for(self, key):
+        return f'/static/tts/cache/{key}.mp3'
+
+    def timings_path_for(self, key):
+        return os.path.join(self.directory, f'{key}.json')
+
+    def get_timings(self, key):
+        """Devuelve {words, wtimes, wdurations} guardados junto al audio, o None."""
+        try:
+            with open(self.timings_path_for(key), 'r', encoding='utf-8') as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return None
+
+    def _load(self):
+        """Indexa los audios ya existentes en disco y borra temporales huérfanos."""
+        found = []
+        for f in os.listdir(self.directory):
+            full = os.path.join(self.directory, f)
+            if f.endswith('.tmp'):
+                try:
+                    os.remove(full)
+                except OSError:
+                    pass
+            elif f.endswith('.mp3'):
+                key = f[:-4]
+                st = os.stat(full)
+                try:
+                    meta_size = os.path.getsize(self.timings_path_for(key))
+                except OSError:
+                    # Audio sin tiempos de palabra (formato anterior): se descarta
+                    os.remove(full)
+                    continue
+                found.append((st.st_mtime, key, st.st_size + meta_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+        with self._lock:
+            self._evict()
+
+    def get(self, key):
+        """Devuelve la ruta del audio si está en caché (y lo marca como reciente), o None."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                path = self.path_for(key)
+            else:
+                self.misses += 1
+                return None
+        try:
+            os.utime(path)  # persiste el orden LRU entre reinicios
+        except OSError:
             pass
+        return path
+
+    def contains(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def temp_path(self, key):
+        return os.path.join(self.directory, f'{key}.{uuid.uuid4().hex[:8]}.tmp')
+
+    def put(self, key, tmp_path, timings):
+        """Publica un audio recién sintetizado (y sus tiempos de palabra) con rename
+        atómico y aplica el presupuesto. El JSON se publica primero: si existe el
+        MP3, existen sus tiempos."""
+        meta_tmp = self.temp_path(key)
+        with open(meta_tmp, 'w', encoding='utf-8') as fp:
+            json.dump(timings, fp, ensure_ascii=False)
+        os.replace(meta_tmp, self.timings_path_for(key))
+        final_path = self.path_for(key)
+        os.replace(tmp_path, final_path)
+        size = os.path.getsize(final_path) + os.path.getsize(self.timings_path_for(key))
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries[key]
+            self._entries[key] = size
+            self._entries.move_to_end(key)
+            self._total_bytes += size
+            self._evict()
+        return final_path
+
+    def _evict(self):
+        # Llamar con self._lock tomado. Nunca expulsa la entrada más reciente.
+        while len(self._entries) > 1 and (
+                len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes):
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            for path in (self.path_for(key), self.timings_path_for(key)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass  # En Windows puede estar abierto por una descarga en curso
+
+    @contextmanager
+    def lock_for(self, key):
+        """Serializa la síntesis de una misma clave entre hilos concurrentes."""
+        with self._lock:
+            entry = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    self._key_locks.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "in_flight": len(self._key_locks),
+            }
+
+
+tts_cache = TTSCache(TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES, TTS_CACHE_MAX_ENTRIES)
+metrics.collector('tts_cache', tts_cache.stats)
+
+
+# Ruta explícita (tiene prioridad sobre /static/<path>) para que los audios se sirvan
+# aunque TTS_CACHE_DIR esté fuera de static/ (p. ej. en benchmark.py)
+@app.route('/static/tts/cache/<path:filename>')
+def serve_tts_cache(filename):
+    return send_media(tts_cache.directory, filename)
+
+
+def _synthesize_to_file(text, voice, rate, path, on_chunk=None):
+    """Sintetiza con edge-tts en el bucle compartido y escribe el MP3 en `path`.
+    on_chunk(bytes) recibe cada trozo de audio en cuanto llega (para streaming).
+    Los eventos WordBoundary se devuelven como words/wtimes/wdurations (en ms),
+    el formato que espera head.speakAudio() de TalkingHead.
+    Si falla, borra el archivo a medio escribir y relanza la excepción."""
+    timings = {"words": [], "wtimes": [], "wdurations": []}
+
+    async def generate():
+        async with tts_worker.limit():
+            communicate = edge_tts.Communicate(text, voice, rate=rate, boundary='WordBoundary',
+                                               connector=tts_worker.connector())
+            with open(path, 'wb') as fp:
+                async for chunk in communicate.stream():
+                    if chunk['type'] == 'audio':
+                        fp.write(chunk['data'])
+                        if on_chunk:
+                            on_chunk(chunk['data'])
+                    elif chunk['type'] == 'WordBoundary':
+                        # offset y duration vienen en unidades de 100 ns
+                        timings['words'].append(chunk['text'])
+                        timings['wtimes'].append(round(chunk['offset'] / 10_000))
+                        timings['wdurations'].append(round(chunk['duration'] / 10_000))
 
-    # Nombres amigables para avatares del catálogo base
-    base_names = {
-        'avatar_default': {'name': 'Femenino Realista', 'gender': 'F'},
+    try:
+        with metrics.stage('tts_synth'):
+            tts_worker.submit(generate(), timeout=TTS_TIMEOUT)
+    except Exception:
+        metrics.inc('tts_synth_errors_total')
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        raise
+    metrics.inc('tts_synth_total')
+    metrics.inc('tts_synth_bytes_total', os.path.getsize(path))
+    return timings
+
+
+def _synthesize_to_cache(key, text, voice, rate, on_chunk=None):
+    """Sintetiza con edge-tts y publica el MP3 en la caché bajo `key`.
+    Devuelve False si otro hilo ya lo había generado mientras esperábamos el candado."""
+    with tts_cache.lock_for(key):
+        if tts_cache.contains(key):
+            return False
+        tmp_path = tts_cache.temp_path(key)
+        timings = _synthesize_to_file(text, voice, rate, tmp_path, on_chunk)
+        tts_cache.put(key, tmp_path, timings)
+        print(f"[TTS] Audio generado: {key}.mp3 ({voice}, {len(timings['words'])} palabras)")
+        return True
+
+
+def _tts_ensure(text, voice, rate):
+    """Garantiza que el audio esté en caché (sintetizándolo si hace falta) y devuelve
+    la respuesta de /tts: audio_url, cached y los tiempos de palabra."""
+    key = TTSCache.make_key(text, voice, rate)
+    cached = tts_cache.get(key) is not None
+    if not cached:
+        _synthesize_to_cache(key, text, voice, rate)
+    else:
+        print(f"[TTS] Caché: {key}.mp3 ({voice})")
+    timings = tts_cache.get_timings(key) or {}
+    return {
+        "key": key,
+        "audio_url": tts_cache.url_for(key),
+        "cached": cached,
+        "words": timings.get('words', []),
+        "wtimes": timings.get('wtimes', []),
+        "wdurations": timings.get('wdurations', [])
     }
 
-    # Escanear SOLO la carpeta avatares/ en disco
-    res_list = []
-    if os.path.exists(MODELS_DIR):
-        for filename in sorted(os.listdir(MODELS_DIR)):
-            if not filename.endswith('.glb'):
-                continue
-            aid = filename.replace('.glb', '')
-            # Prioridad: base_names > custom_avatars.json > nombre derivado del filename
-            info = base_names.get(aid) or metadata.get(aid) or {}
-            res_list.append({
-                'id': aid,
-                'name': info.get('name', aid.replace('_', ' ').title()),
-                'gender': info.get('gender', 'F'),
-                'path': f'/avatares/{filename}',
-                'is_local': True
-            })
 
-    return jsonify({"status": "ok", "avatars": res_list})
+def _iter_file(path, chunk_size=64 * 1024):
+    with open(path, 'rb') as fp:
+        while True:
+            block = fp.read(chunk_size)
+            if not block:
+                return
+            yield block
 
 
 # ======== Voces Neurales con Edge-TTS ========
+# Autor: Ing. Walter Rodríguez - 2026-10-18
+# La lista de voces de Microsoft casi nunca cambia: se guarda en memoria y en
+# cache/voces.json, se refresca en segundo plano cuando vence el TTL y, sin red,
+# se sigue sirviendo la última copia buena. El arranque no toca la red.
+# Sin ninguna copia, las peticiones simultáneas esperan a una sola descarga y, si falla,
+# responden error sin volver a intentarlo hasta pasados VOICES_RETRY_DELAY segundos.
+VOICES_CACHE_FILE = os.path.join(CACHE_DIR, 'voces.json')
+VOICES_TTL = float(os.getenv('TTS_VOICES_TTL', str(24 * 3600)))
+VOICES_RETRY_DELAY = 60
+
+
+class VoiceCatalog:
+    """Voces neurales indexadas por locale, idioma y género."""
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self._voices = []
+        self._fetched_at = 0.0   # time.time() de la última descarga buena (persiste en disco)
+        self._by_locale = {}
+        self._by_lang = {}
+        self._refreshing = False
+        self._retry_at = 0.0     # tras un fallo no se reintenta en cada petición
+        self._first_fetch = SingleFlight()
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as fp:
+                data = json.load(fp)
+            self._index(data['voices'], data['fetched_at'])
+            print(f"[TTS-VOICES] {len(self._voices)} voces cargadas de {os.path.basename(self.path)}")
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _index(self, voices, fetched_at):
+        by_locale, by_lang = {}, {}
+        for v in voices:
+            by_locale.setdefault(v['locale'].lower(), []).append(v)
+            by_lang.setdefault(v['locale'].split('-')[0].lower(), []).append(v)
+        with self._lock:
+            self._voices, self._fetched_at = voices, fetched_at
+            self._by_locale, self._by_lang = by_locale, by_lang
+
+    def refresh(self):
+        """Descarga la lista desde Microsoft y la publica en memoria y disco."""
+        async def fetch_voices():
+            return await edge_tts.list_voices(connector=tts_worker.connector())
+
+        try:
+            raw = tts_worker.submit(fetch_voices(), timeout=TTS_TIMEOUT)
+            voices = [{
+                'name': v['ShortName'],
+                'friendlyName': f"{v['FriendlyName']} ({v['Locale']})",
+                'locale': v['Locale'],
+                'gender': v['Gender']
+            } for v in raw if "Neural" in v['ShortName']]
+            # Ordenar: primero español
+            voices.sort(key=lambda x: (not x['locale'].startswith('es'), x['locale'], x['name']))
+            fetched_at = time.time()
+            self._index(voices, fetched_at)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f'{self.path}.{uuid.uuid4().hex[:8]}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as fp:
+                json.dump({"fetched_at": fetched_at, "voices": voices}, fp, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            print(f"[TTS-VOICES] {len(voices)} voces neurales actualizadas")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _refresh_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            self._retry_at = time.time() + VOICES_RETRY_DELAY
+            print(f"[TTS-VOICES] Sin conexión, se mantiene la copia anterior: {e}")
+
+    def _refresh_first(self):
+        with self._lock:
+            if self._voices:  # otra descarga terminó mientras esta esperaba turno
+                return
+            self._refreshing = True
+        try:
+            self.refresh()
+        except Exception:
+            self._retry_at = time.time() + VOICES_RETRY_DELAY
+            raise
+
+    def ensure(self):
+        """Sin ninguna copia descarga ahora (una sola descarga para todas las peticiones);
+        si la copia venció, lanza un refresco en segundo plano y sigue sirviendo la que hay."""
+        with self._lock:
+            empty = not self._voices
+            stale = time.time() - self._fetched_at > self.ttl
+            wait = self._retry_at - time.time()
+            start = stale and not empty and not self._refreshing and wait <= 0
+            if start:
+                self._refreshing = True
+        if empty:
+            if wait > 0:
+                raise RuntimeError(f"Lista de voces no disponible, reintenta en {wait:.0f} s")
+            self._first_fetch.do('voices', self._refresh_first)
+        elif start:
+            threading.Thread(target=self._refresh_background, name='tts-voices', daemon=True).start()
+
+    def query(self, locales=None, gender=None, q=None):
+        """locales: lista de 'es' (idioma) o 'es-MX' (locale exacto); gender: Female/Male;
+        q: texto a buscar en el nombre. Sin locales devuelve español + en-US (como antes)."""
+        with self._lock:
+            if locales is None:
+                voices = self._by_lang.get('es', []) + self._by_locale.get('en-us', [])
+            elif locales == ['*']:
+                voices = list(self._voices)
+            else:
+                voices, seen = [], set()
+                for loc in locales:
+                    loc = loc.lower()
+                    for v in self._by_locale.get(loc, []) if '-' in loc else self._by_lang.get(loc, []):
+                        if v['name'] not in seen:
+                            seen.add(v['name'])
+                            voices.append(v)
+        if gender:
+            voices = [v for v in voices if v['gender'].lower() == gender.lower()]
+        if q:
+            q = q.lower()
+            voices = [v for v in voices if q in v['friendlyName'].lower() or q in v['name'].lower()]
+        return voices
+
+    def info(self):
+        with self._lock:
+            age = time.time() - self._fetched_at if self._fetched_at else None
+            return {"fetched_at": self._fetched_at or None, "stale": age is None or age > self.ttl,
+                    "total": len(self._voices), "locales": sorted(self._by_locale)}
+
+
+voice_catalog = VoiceCatalog(VOICES_CACHE_FILE, VOICES_TTL)
+metrics.collector('voices', voice_catalog.info)
+
+
 @app.route('/tts-voices')
+@slow_route
 def tts_voices():
     """Lista las voces neurales disponibles (Microsoft Edge).
-    Autor: Ing. Walter Rodríguez - 2026-02-18"""
+    Autor: Ing. Walter Rodríguez - 2026-02-18
+    Parámetros opcionales: locale=es,en-US (idioma o locale; * para todas), gender=Female|Male, q=texto.
+    Sin parámetros: voces en español y en-US, con el español primero."""
     try:
-        loop = asyncio.new_event_loop()
-        voices = loop.run_until_complete(edge_tts.list_voices())
-        loop.close()
-        
-        # Filtrar voces Priorizando 'Neural' y español/inglés
-        filtered_voices = [v for v in voices if "Neural" in v['ShortName'] and (v['Locale'].startswith('es-') or v['Locale'] == 'en-US')]
-        
-        result = []
-        for v in filtered_voices:
-            friendly = f"{v['FriendlyName']} ({v['Locale']})"
-            result.append({
-                'name': v['ShortName'],
-                'friendlyName': friendly,
-                'locale': v['Locale'],
-                'gender': v['Gender']
-            })
-            
-        # Ordenar: primero español
-        result.sort(key=lambda x: (not x['locale'].startswith('es'), x['locale']))
-        
-        return jsonify({"status": "ok", "voices": result})
+        voice_catalog.ensure()
     except Exception as e:
         print(f"[TTS-VOICES] Error: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+    locales = [l.strip() for l in request.args.get('locale', '').split(',') if l.strip()] or None
+    result = voice_catalog.query(locales, request.args.get('gender'), request.args.get('q'))
+    info = voice_catalog.info()
+    response = jsonify({"status": "ok", "voices": result, "fetched_at": info['fetched_at'],
+                        "stale": info['stale']})
+    query_tag = hashlib.sha1(request.query_string).hexdigest()[:8] if request.query_string else ''
+    response.set_etag(f"voices-{int(info['fetched_at'] or 0)}{'-' + query_tag if query_tag else ''}")
+    return response.make_conditional(request)
+
+
+@app.route('/tts-voices/info', methods=['GET'])
+def tts_voices_info():
+    """Estado del catálogo de voces: antigüedad, total y locales disponibles."""
+    return jsonify({"status": "ok", **voice_catalog.info()})
+
+
 @app.route('/tts', methods=['POST'])
+@slow_route
 def text_to_speech():
     """Genera audio con Microsoft Edge-TTS (Gratis y Neural).
     Autor: Ing. Walter Rodríguez - 2026-02-18"""
@@ -564,44 +2834,966 @@ def text_to_speech():
     if not text:
         return jsonify({"status": "error", "message": "No se proporcionó texto"}), 400
     
-    os.makedirs(TTS_DIR, exist_ok=True)
-    audio_filename = f"tts_{uuid.uuid4().hex[:8]}.mp3"
-    audio_path = os.path.join(TTS_DIR, audio_filename)
-    
     try:
-        async def generate():
-            communicate = edge_tts.Communicate(text, voice, rate=rate)
-            await communicate.save(audio_path)
-            
-        loop = asyncio.new_event_loop()
-        loop.run_until_complete(generate())
-        loop.close()
-        
-        print(f"[TTS] Audio generado: {audio_filename} ({voice})")
-        
-        # Limpieza automática
-        try:
-            tts_files = sorted(
-                [f for f in os.listdir(TTS_DIR) if f.startswith('tts_')],
-                key=lambda f: os.path.getmtime(os.path.join(TTS_DIR, f))
-            )
-            while len(tts_files) > 10:
-                os.remove(os.path.join(TTS_DIR, tts_files.pop(0)))
-        except:
-            pass
-            
-        return jsonify({
-            "status": "ok",
-            "audio_url": f"/static/tts/{audio_filename}"
-        })
+        return jsonify({"status": "ok", **_tts_ensure(text, voice, rate)})
     except Exception as e:
         print(f"[TTS] Error: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/tts/stream', methods=['GET', 'POST'])
+@slow_route
+def text_to_speech_stream():
+    """Igual que /tts pero devuelve directamente el MP3 y lo va enviando por trozos
+    mientras edge-tts lo sintetiza (sin esperar el archivo completo ni una segunda petición).
+    Acepta JSON por POST o ?text=&voice=&rate= por GET (útil para <audio src=...>).
+    Autor: Ing. Walter Rodríguez - 2026-10-18"""
+    data = request.get_json(silent=True) or request.args
+    text = data.get('text', '').strip()
+    voice = data.get('voice', 'es-DO-RamonaNeural')
+    rate = data.get('rate', '+0%')
+
+    if not text:
+        return jsonify({"status": "error", "message": "No se proporcionó texto"}), 400
+
+    key = TTSCache.make_key(text, voice, rate)
+    if tts_cache.get(key) is not None:
+        print(f"[TTS] Caché (stream): {key}.mp3 ({voice})")
+        return Response(_iter_file(tts_cache.path_for(key)), mimetype='audio/mpeg',
+                        headers={'X-TTS-Cache': 'hit', 'X-TTS-Key': key})
+
+    # La síntesis corre en su propio hilo y entrega los trozos por una cola;
+    # si el cliente se desconecta, el audio se termina igual y queda en caché.
+    chunks = queue.Queue()
+    fin = object()
+
+    def worker():
+        try:
+            if not _synthesize_to_cache(key, text, voice, rate, on_chunk=chunks.put):
+                chunks.put(tts_cache.path_for(key))  # otro hilo lo generó mientras esperábamos
+            chunks.put(fin)
+        except Exception as e:
+            print(f"[TTS] Error (stream): {e}")
+            chunks.put(e)
+
+    threading.Thread(target=worker, daemon=True).start()
+
+    # Si falla antes del primer trozo todavía se puede responder con un error normal
+    first = chunks.get()
+    if isinstance(first, Exception):
+        return jsonify({"status": "error", "message": str(first)}), 500
+
+    def generate():
+        item = first
+        while item is not fin:
+            if isinstance(item, Exception):
+                # Las cabeceras (200) ya salieron: se corta la conexión sin el cierre del
+                # cuerpo para que el cliente vea un error de red y no un MP3 truncado.
+                raise RuntimeError(f"Síntesis interrumpida ({key}): {item}") from item
+            if isinstance(item, str):
+                yield from _iter_file(item)
+            else:
+                yield item
+            item = chunks.get()
+
+    return Response(generate(), mimetype='audio/mpeg',
+                    headers={'X-TTS-Cache': 'miss', 'X-TTS-Key': key})
+
+@app.route('/tts/words/<key>', methods=['GET'])
+def tts_words(key):
+    """Tiempos de palabra (words/wtimes/wdurations en ms) de un audio en caché.
+    La clave llega en la cabecera X-TTS-Key de /tts/stream. Con ?wait=1, si esa clave se
+    está sintetizando, espera a que termine: el cliente la pide en paralelo con el audio.
+    Autor: Ing. Walter Rodríguez - 2026-10-18"""
+    if not key.isalnum():
+        return jsonify({"status": "error", "message": "Clave no válida"}), 400
+    timings = tts_cache.get_timings(key)
+    if timings is None and request.args.get('wait') == '1':
+        with tts_cache.lock_for(key):
+            pass
+        timings = tts_cache.get_timings(key)
+    if timings is None:
+        return jsonify({"status": "error", "message": "Audio no encontrado en caché"}), 404
+    return jsonify({"status": "ok", **timings})
+
+@app.route('/tts/cache', methods=['GET'])
+def tts_cache_stats():
+    """Estadísticas de la caché de audio TTS (aciertos, fallos, tamaño).
+    Autor: Ing. Walter Rodríguez - 2026-10-18"""
+    return jsonify({"status": "ok", "cache": tts_cache.stats()})
+
+# ======== TTS por oraciones en paralelo ========
+# Autor: Ing. Walter Rodríguez - 2026-10-18
+# Los textos largos (salida de /adaptar, descripciones de inventario) se parten en
+# oraciones que se sintetizan a la vez; el avatar puede empezar a hablar en cuanto
+# la primera está lista y el tiempo total depende de la oración más larga.
+TTS_SEGMENT_WORKERS = int(os.getenv('TTS_SEGMENT_WORKERS', '4'))
+_tts_segment_pool = concurrent.futures.ThreadPoolExecutor(
+    max_workers=TTS_SEGMENT_WORKERS, thread_name_prefix='tts-segment')
+
+# Solo las etiquetas que define _PROMPT_DIRECTOR; otros paréntesis, p. ej. "(talla M)",
+# son parte del texto del producto y se leen tal cual.
+EMOCIONES = ('feliz', 'triste', 'enojo', 'sorpresa', 'guiño', 'serio', 'broma', 'llorar')
+_EMOTION_TAG_RE = re.compile(r'\(\s*(' + '|'.join(EMOCIONES) + r')\s*\)', re.IGNORECASE)
+_SENTENCE_END_RE = re.compile(r'(?<=[.!?…])\s+')
+
+
+def split_segments(text):
+    """Parte el texto en oraciones respetando las etiquetas de emoción de /adaptar.
+    Cada etiqueta, p. ej. (feliz), se asigna a la oración que la sigue y se quita del texto.
+    Devuelve [{"text": ..., "emotion": "feliz" | None}, ...]."""
+    segments = []
+    emotion = None
+    pos = 0
+    pieces = []
+    for m in _EMOTION_TAG_RE.finditer(text):
+        pieces.append((text[pos:m.start()], emotion))
+        emotion = m.group(1).lower()
+        pos = m.end()
+    pieces.append((text[pos:], emotion))
+
+    for chunk, chunk_emotion in pieces:
+        for i, sentence in enumerate(_SENTENCE_END_RE.split(chunk.strip())):
+            sentence = ' '.join(sentence.split())
+            if sentence:
+                segments.append({"text": sentence, "emotion": chunk_emotion if i == 0 else None})
+    return segments
+
+
+@app.route('/tts/segments', methods=['POST'])
+@slow_route
+def text_to_speech_segments():
+    """Sintetiza un texto largo oración por oración en paralelo (pool acotado).
+    Devuelve los segmentos en orden con su emoción y tiempos de palabra.
+    Con "stream": true responde NDJSON: un segmento por línea, en orden, en cuanto está listo.
+    Autor: Ing. Walter Rodríguez - 2026-10-18"""
+    data = request.get_json(silent=True) or {}
+    text = data.get('text', '').strip()
+    voice = data.get('voice', 'es-DO-RamonaNeural')
+    rate = data.get('rate', '+0%')
+
+    segments = split_segments(text)
+    if not segments:
+        return jsonify({"status": "error", "message": "No se proporcionó texto"}), 400
+
+    futures = [_tts_segment_pool.submit(_tts_ensure, seg['text'], voice, rate) for seg in segments]
+    print(f"[TTS] {len(segments)} segmentos en paralelo ({voice})")
+
+    def result(i):
+        seg = {"index": i, "text": segments[i]['text'], "emotion": segments[i]['emotion']}
+        try:
+            seg.update(status="ok", **futures[i].result())
+        except Exception as e:
+            print(f"[TTS] Error en segmento {i}: {e}")
+            seg.update(status="error", message=str(e))
+        return seg
+
+    if data.get('stream'):
+        def generate():
+            for i in range(len(segments)):
+                yield json.dumps(result(i), ensure_ascii=False) + '\n'
+        return Response(generate(), mimetype='application/x-ndjson')
+
+    results = [result(i) for i in range(len(segments))]
+    failed = [r for r in results if r['status'] != 'ok']
+    if len(failed) == len(results):
+        return jsonify({"status": "error", "message": failed[0]['message'], "segments": results}), 500
+    return jsonify({"status": "ok", "segments": results})
+
+
+# ======== Preparación anticipada del siguiente artículo ========
+# Autor: Ing. Walter Rodríguez - 2026-10-18
+# Mientras el avatar presenta el artículo N, el frontend pide preparar el N+1:
+# se arma el guion, se sintetizan sus oraciones (quedan en la caché TTS con sus tiempos)
+# y se deja listo su manifiesto multimedia. El cambio de producto es inmediato.
+_prepare_pool = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix='prepare')
+_prepare_jobs = OrderedDict()   # (item_id, voice, rate) -> estado del trabajo
+_prepare_lock = threading.Lock()
+PREPARE_JOBS_MAX = 50
+
+
+def build_item_script(item):
+    """Guion que dice el avatar al presentar un artículo (igual que nextInventoryItem en index.html)."""
+    cantidad = item.get('Cantidad') or 0
+    if isinstance(cantidad, float) and cantidad.is_integer():
+        cantidad = int(cantidad)
+    return f"{item.get('Nombre', '')}. Vamos a vender {cantidad} unidades. {item.get('Descripción', '')}"
+
+
+def _prepare_item(job, voice, rate):
+    try:
+        segments = split_segments(job['script'])
+        futures = [_tts_segment_pool.submit(_tts_ensure, seg['text'], voice, rate) for seg in segments]
+        files = media_manifest.files(job['id'])
+        for seg, future in zip(segments, futures):
+            seg.update(future.result())
+        with _prepare_lock:
+            job.update(state='ready', segments=segments, files=files)
+        print(f"[PREPARAR] Artículo {job['id']} listo ({len(segments)} segmentos)")
+    except Exception as e:
+        with _prepare_lock:
+            job.update(state='error', message=str(e))
+        print(f"[PREPARAR] Error con artículo {job['id']}: {e}")
+
+
+@app.route('/inventario/prepare', methods=['POST'])
+def prepare_inventario_item():
+    """Prepara en segundo plano el audio, los tiempos y la multimedia de un artículo.
+    Body: {"id": <ID del Excel>, "voice": ..., "rate": ...}. Responde enseguida con el estado.
+    Autor: Ing. Walter Rodríguez - 2026-10-18"""
+    data = request.get_json(silent=True) or {}
+    item_id = str(data.get('id', '')).strip()
+    voice = data.get('voice', 'es-DO-RamonaNeural')
+    rate = data.get('rate', '+0%')
+    try:
+        item = inventory_index.get().find(item_id)
+    except FileNotFoundError:
+        return jsonify({"status": "error", "message": "No se encontró Inventario/Inventario.xlsx"}), 404
+    if item is None:
+        return jsonify({"status": "error", "message": f"Artículo {item_id} no encontrado"}), 404
+
+    key = (item_id, voice, rate)
+    script = build_item_script(item)
+    with _prepare_lock:
+        job = _prepare_jobs.get(key)
+        if job is None or job['state'] == 'error' or job['script'] != script:
+            job = {"id": item_id, "state": 'running', "script": script}
+            _prepare_jobs[key] = job
+            while len(_prepare_jobs) > PREPARE_JOBS_MAX:
+                _prepare_jobs.popitem(last=False)
+            _prepare_pool.submit(_prepare_item, job, voice, rate)
+        _prepare_jobs.move_to_end(key)
+        job = dict(job)
+    return jsonify({"status": "ok", **job})
+
+
+@app.route('/inventario/prepare/<item_id>', methods=['GET'])
+def prepare_inventario_status(item_id):
+    """Estado de la preparación de un artículo (?voice=&rate= como en la petición original)."""
+    key = (item_id, request.args.get('voice', 'es-DO-RamonaNeural'), request.args.get('rate', '+0%'))
+    with _prepare_lock:
+        job = dict(_prepare_jobs.get(key) or {})
+    if not job:
+        return jsonify({"status": "error", "message": "Sin preparación para ese artículo"}), 404
+    return jsonify({"status": "ok", **job})
+
+
+# ======== Pre-adaptación del inventario completo con Gemini (por lotes) ========
+# Autor: Ing. Walter Rodríguez - 2026-10-18
+# Antes del en vivo se adapta todo el inventario: varios guiones por llamada, pocas
+# llamadas en paralelo y pausa compartida cuando Google responde 429. Los resultados
+# quedan en cache/adaptaciones_inventario.json y en la caché de /adaptar.
+ADAPT_BATCH_FILE = os.path.join(CACHE_DIR, 'adaptaciones_inventario.json')
+ADAPT_BATCH_SIZE = int(os.getenv('ADAPT_BATCH_SIZE', '10'))
+ADAPT_BATCH_CONCURRENCY = int(os.getenv('ADAPT_BATCH_CONCURRENCY', '3'))
+ADAPT_BATCH_MAX_RETRIES = 5
+
+
+class RateLimitGate:
+    """Pausa compartida entre hilos: si un lote recibe 429, todos esperan antes del siguiente intento."""
+
+    def __init__(self):
+        self._until = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        delay = self._until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def backoff(self, seconds):
+        with self._lock:
+            self._until = max(self._until, time.monotonic() + seconds)
+
+
+def _retry_delay(resp, attempt):
+    """Segundos a esperar tras un 429/5xx: Retry-After, luego retryDelay de Google, luego exponencial."""
+    try:
+        return float(resp.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        pass
+    try:
+        for detail in resp.json().get('error', {}).get('details', []):
+            if 'retryDelay' in detail:
+                return float(str(detail['retryDelay']).rstrip('s'))
+    except Exception:
+        pass
+    return min(60.0, 2 ** attempt) + random.uniform(0, 1)
+
+
+def _parse_lote(texto):
+    """Convierte la respuesta JSON del modelo en {id: texto_adaptado} (tolera ```json ... ```)."""
+    texto = texto.strip()
+    if texto.startswith('```'):
+        texto = texto.strip('`')
+        texto = texto[texto.find('['):]
+    return {str(x['id']): str(x['texto']).strip() for x in json.loads(texto)
+            if isinstance(x, dict) and 'id' in x and 'texto' in x}
+
+
+def _adaptar_lote(lote, google_api_key, gate):
+    """Adapta [(id, guion), ...] en una sola llamada. Devuelve ({id: texto}, modelo)."""
+    textos = json.dumps([{"id": i, "texto": t} for i, t in lote], ensure_ascii=False)
+    payload = {
+        "contents": [{"parts": [{"text": ADAPTAR_LOTE_PROMPT.format(textos=textos)}]}],
+        "generationConfig": {"temperature": 0.4, "maxOutputTokens": 8192,
+                             "responseMimeType": "application/json"}
+    }
+    for attempt in range(ADAPT_BATCH_MAX_RETRIES):
+        gate.wait()
+        _, _, usables, _ = gemini_models.discover(google_api_key)
+        if not usables:
+            raise RuntimeError("No se pudieron listar los modelos de Gemini")
+        r = None
+        for modelo in gemini_models.candidates(usables):
+            r = _call_gemini(modelo, google_api_key, payload)
+            if r.status_code == 200:
+                gemini_models.record_success(modelo)
+                result = r.json()
+                return _parse_lote(result['candidates'][0]['content']['parts'][0]['text']), modelo
+            if r.status_code in (404, 400):
+                if r.status_code == 404:
+                    gemini_models.record_failure(modelo)
+                continue
+            if r.status_code == 429 or r.status_code >= 500:
+                gemini_models.record_failure(modelo)
+            break
+        if r is not None and (r.status_code == 429 or r.status_code >= 500):
+            delay = _retry_delay(r, attempt)
+            print(f"[ADAPTAR-LOTE] HTTP {r.status_code}, reintento en {delay:.1f} s")
+            gate.backoff(delay)
+            continue
+        raise RuntimeError(f"Gemini respondió HTTP {r.status_code if r is not None else '?'}")
+    raise RuntimeError(f"Cuota de Gemini agotada tras {ADAPT_BATCH_MAX_RETRIES} reintentos")
+
+
+_adapt_batch_lock = threading.Lock()
+_adapt_batch = {"state": 'idle'}
+
+
+def _guardar_adaptaciones(resultados):
+    os.makedirs(os.path.dirname(ADAPT_BATCH_FILE), exist_ok=True)
+    tmp_path = f'{ADAPT_BATCH_FILE}.{uuid.uuid4().hex[:8]}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as fp:
+        json.dump({"prompt_version": ADAPTAR_PROMPT_VERSION, "items": resultados}, fp,
+                  ensure_ascii=False, indent=2)
+    os.replace(tmp_path, ADAPT_BATCH_FILE)
+
+
+def _run_adapt_batch(job, google_api_key, batch_size, concurrency):
+    def update(**kw):
+        with _adapt_batch_lock:
+            job.update(kw)
+
+    try:
+        items = inventory_index.get().items
+        guiones = [(str(it.get('ID')), build_item_script(it)) for it in items]
+        resultados = {}
+        pendientes = []
+        for item_id, guion in guiones:
+            cached = adapt_cache.get(adapt_cache.make_key(guion))
+            if cached is not None:
+                resultados[item_id] = {"script": guion, **cached}
+            else:
+                pendientes.append((item_id, guion))
+        lotes = [pendientes[i:i + batch_size] for i in range(0, len(pendientes), batch_size)]
+        update(total=len(guiones), done=len(resultados), from_cache=len(resultados),
+               batches=len(lotes), batches_done=0)
+        print(f"[ADAPTAR-LOTE] {len(guiones)} artículos, {len(resultados)} en caché, "
+              f"{len(lotes)} lotes de hasta {batch_size}")
+
+        gate = RateLimitGate()
+        guion_por_id = dict(pendientes)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency,
+                                                   thread_name_prefix='adapt-batch') as pool:
+            futures = {pool.submit(_adaptar_lote, lote, google_api_key, gate): lote for lote in lotes}
+            for future in concurrent.futures.as_completed(futures):
+                lote = futures[future]
+                try:
+                    adaptados, modelo = future.result()
+                except Exception as e:
+                    adaptados, modelo = {}, None
+                    print(f"[ADAPTAR-LOTE] Error en lote: {e}")
+                    with _adapt_batch_lock:
+                        job['errors'].append(str(e))
+                for item_id, _ in lote:
+                    texto = adaptados.get(item_id)
+                    if texto is None:
+                        continue
+                    entry = {"texto_adaptado": texto, "modelo": modelo}
+                    adapt_cache.put(adapt_cache.make_key(guion_por_id[item_id]), entry)
+                    resultados[item_id] = {"script": guion_por_id[item_id], **entry}
+                _guardar_adaptaciones(resultados)
+                with _adapt_batch_lock:
+                    job['done'] = len(resultados)
+                    job['failed'] += sum(1 for item_id, _ in lote if item_id not in adaptados)
+                    job['batches_done'] += 1
+
+        _guardar_adaptaciones(resultados)
+        adapt_cache.flush()
+        update(state='done', finished_at=time.time())
+        print(f"[ADAPTAR-LOTE] Terminado: {len(resultados)}/{len(guiones)} adaptados")
+    except Exception as e:
+        print(f"[ADAPTAR-LOTE] Error: {e}")
+        update(state='error', message=str(e), finished_at=time.time())
+
+
+@app.route('/inventario/adaptar-todo', methods=['GET', 'POST'])
+def adaptar_inventario():
+    """POST inicia la adaptación de todo el inventario en segundo plano
+    (opcional: {"batch_size": 10, "concurrency": 3}); GET devuelve el progreso.
+    Autor: Ing. Walter Rodríguez - 2026-10-18"""
+    if request.method == 'POST':
+        google_api_key = os.getenv('Google-API-KEY', '').strip()
+        if not google_api_key:
+            return jsonify({"status": "error", "message": "Google-API-KEY no configurada en .env"}), 500
+        if not os.path.exists(INVENTARIO_XLSX):
+            return jsonify({"status": "error", "message": "No se encontró Inventario/Inventario.xlsx"}), 404
+        data = request.get_json(silent=True) or {}
+        try:
+            batch_size = max(1, min(int(data.get('batch_size', ADAPT_BATCH_SIZE)), 50))
+            concurrency = max(1, min(int(data.get('concurrency', ADAPT_BATCH_CONCURRENCY)), 10))
+        except (TypeError, ValueError):
+            return jsonify({"status": "error", "message": "batch_size y concurrency deben ser números"}), 400
+        with _adapt_batch_lock:
+            if _adapt_batch.get('state') != 'running':
+                _adapt_batch.clear()
+                _adapt_batch.update(state='running', total=0, done=0, from_cache=0, failed=0,
+                                    batches=0, batches_done=0, errors=[], started_at=time.time(),
+                                    file=ADAPT_BATCH_FILE)
+                threading.Thread(target=_run_adapt_batch, name='adapt-batch', daemon=True,
+                                 args=(_adapt_batch, google_api_key, batch_size, concurrency)).start()
+
+    with _adapt_batch_lock:
+        job = dict(_adapt_batch, errors=list(_adapt_batch.get('errors', [])[-10:]))
+    if job.get('started_at'):
+        job['elapsed_s'] = round((job.get('finished_at') or time.time()) - job['started_at'], 1)
+    return jsonify({"status": "ok", **job})
+
+
+# ======== Render completo del guion del en vivo (shows/<nombre>/) ========
+# Autor: Ing. Walter Rodríguez - 2026-10-18
+# Antes de salir en vivo se sintetiza todo el guion (o todo el inventario) a una carpeta:
+# un MP3 y un JSON de tiempos de palabra por oración, más manifest.json con el orden.
+# Durante la transmisión el audio es local: sin latencia de síntesis ni dependencia de la red.
+# Si el render se corta, al relanzarlo continúa donde quedó (cada JSON lleva la clave de su audio).
+SHOWS_DIR = os.path.join(BASE_DIR, 'shows')
+SHOW_RENDER_CONCURRENCY = int(os.getenv('SHOW_RENDER_CONCURRENCY', '4'))
+SHOW_MANIFEST = 'manifest.json'
+_SHOW_NAME_RE = re.compile(r'^[\w\-]{1,64}$')
+_show_jobs = {}   # nombre -> progreso del render en curso o del último
+_show_lock = threading.Lock()
+
+
+def _show_dir(name):
+    return os.path.join(SHOWS_DIR, name)
+
+
+def _leer_manifest_show(name):
+    try:
+        with open(os.path.join(_show_dir(name), SHOW_MANIFEST), 'r', encoding='utf-8') as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+
+def _guardar_manifest_show(name, manifest):
+    path = os.path.join(_show_dir(name), SHOW_MANIFEST)
+    tmp_path = f'{path}.{uuid.uuid4().hex[:8]}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as fp:
+        json.dump(manifest, fp, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _guiones_inventario(usar_adaptaciones=True):
+    """Guion de cada artículo del Excel, en orden. Si hay una adaptación de
+    /inventario/adaptar-todo para ese mismo guion, se usa el texto adaptado (con emociones)."""
+    adaptados = {}
+    if usar_adaptaciones:
+        try:
+            with open(ADAPT_BATCH_FILE, 'r', encoding='utf-8') as fp:
+                adaptados = json.load(fp).get('items', {})
+        except (OSError, ValueError):
+            pass
+    guiones = []
+    for item in inventory_index.get().items:
+        item_id = str(item.get('ID'))
+        script = build_item_script(item)
+        entry = adaptados.get(item_id) or {}
+        texto = entry.get('texto_adaptado') if entry.get('script') == script else None
+        guiones.append({"id": item_id, "text": texto or script})
+    return guiones
+
+
+def _plan_show(name, guiones, voice, rate):
+    """Manifiesto del show: cada guion partido en oraciones con su archivo NNN-SS.mp3."""
+    items = []
+    for i, guion in enumerate(guiones):
+        segments = []
+        for j, seg in enumerate(split_segments(guion['text'])):
+            base = f'{i:03d}-{j:02d}'
+            segments.append({
+                "text": seg['text'],
+                "emotion": seg['emotion'],
+                "key": TTSCache.make_key(seg['text'], voice, rate),
+                "audio": f'{base}.mp3',
+                "timings": f'{base}.json',
+                "state": 'pending',
+            })
+        items.append({"index": i, "id": guion.get('id'), "text": guion['text'], "segments": segments})
+    return {"name": name, "voice": voice, "rate": rate, "state": 'rendering',
+            "created_at": time.time(), "items": items}
+
+
+def _segmento_listo(directory, seg):
+    """True si el segmento ya se renderizó con este mismo texto, voz y velocidad."""
+    try:
+        with open(os.path.join(directory, seg['timings']), 'r', encoding='utf-8') as fp:
+            listo = json.load(fp).get('key') == seg['key']
+    except (OSError, ValueError):
+        return False
+    return listo and os.path.exists(os.path.join(directory, seg['audio']))
+
+
+def _render_segmento(directory, seg, voice, rate):
+    """Escribe el MP3 y sus tiempos. Si el audio ya está en la caché TTS se copia
+    en vez de sintetizarlo. El JSON se publica al final: es la marca de segmento terminado."""
+    audio_path = os.path.join(directory, seg['audio'])
+    tmp_path = f'{audio_path}.{uuid.uuid4().hex[:8]}.tmp'
+    timings = None
+    if tts_cache.contains(seg['key']):
+        try:
+            shutil.copyfile(tts_cache.path_for(seg['key']), tmp_path)
+            timings = tts_cache.get_timings(seg['key'])
+        except OSError:
+            timings = None  # Expulsado de la caché mientras copiábamos
+    if timings is None:
+        timings = _synthesize_to_file(seg['text'], voice, rate, tmp_path)
+    os.replace(tmp_path, audio_path)
+    timings_path = os.path.join(directory, seg['timings'])
+    meta_tmp = f'{timings_path}.{uuid.uuid4().hex[:8]}.tmp'
+    with open(meta_tmp, 'w', encoding='utf-8') as fp:
+        json.dump({"key": seg['key'], **timings}, fp, ensure_ascii=False)
+    os.replace(meta_tmp, timings_path)
+
+
+def _run_show_render(name, manifest, job, concurrency):
+    def update(**kw):
+        with _show_lock:
+            job.update(kw)
+
+    directory = _show_dir(name)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        # Quitar restos de renders anteriores que ya no forman parte del guion
+        vigentes = {SHOW_MANIFEST}
+        for item in manifest['items']:
+            for seg in item['segments']:
+                vigentes.update((seg['audio'], seg['timings']))
+        for f in os.listdir(directory):
+            if f not in vigentes:
+                try:
+                    os.remove(os.path.join(directory, f))
+                except OSError:
+                    pass
+
+        segmentos = [seg for item in manifest['items'] for seg in item['segments']]
+        pendientes = []
+        for seg in segmentos:
+            if _segmento_listo(directory, seg):
+                seg['state'] = 'done'
+            else:
+                pendientes.append(seg)
+        update(total=len(segmentos), done=len(segmentos) - len(pendientes),
+               skipped=len(segmentos) - len(pendientes))
+        manifest['total_segments'] = len(segmentos)
+        _guardar_manifest_show(name, manifest)
+        print(f"[SHOW] {name}: {len(manifest['items'])} guiones, {len(segmentos)} oraciones, "
+              f"{len(pendientes)} por renderizar")
+
+        ultimo_guardado = time.monotonic()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency,
+                                                   thread_name_prefix='show-render') as pool:
+            futures = {pool.submit(_render_segmento, directory, seg, manifest['voice'], manifest['rate']): seg
+                       for seg in pendientes}
+            for future in concurrent.futures.as_completed(futures):
+                seg = futures[future]
+                try:
+                    future.result()
+                    seg['state'] = 'done'
+                    seg.pop('message', None)
+                except Exception as e:
+                    seg.update(state='error', message=str(e))
+                    print(f"[SHOW] {name}: error en {seg['audio']}: {e}")
+                with _show_lock:
+                    job['done' if seg['state'] == 'done' else 'failed'] += 1
+                    if seg['state'] == 'error':
+                        job['errors'].append(f"{seg['audio']}: {seg['message']}")
+                # El manifiesto se reescribe a lo sumo una vez por segundo
+                if time.monotonic() - ultimo_guardado > 1.0:
+                    _guardar_manifest_show(name, manifest)
+                    ultimo_guardado = time.monotonic()
+
+        for seg in segmentos:
+            if seg['state'] == 'done':
+                st = os.stat(os.path.join(directory, seg['audio']))
+                seg['url'] = f"/shows/{name}/{seg['audio']}?v={media_version(st)}"
+        fallidos = sum(1 for seg in segmentos if seg['state'] != 'done')
+        manifest.update(state='done' if not fallidos else 'incomplete', rendered_at=time.time())
+        _guardar_manifest_show(name, manifest)
+        update(state=manifest['state'], finished_at=time.time())
+        print(f"[SHOW] {name}: terminado, {len(segmentos) - fallidos}/{len(segmentos)} oraciones")
+    except Exception as e:
+        print(f"[SHOW] {name}: error: {e}")
+        manifest['state'] = 'error'
+        try:
+            _guardar_manifest_show(name, manifest)
+        except OSError:
+            pass
+        update(state='error', message=str(e), finished_at=time.time())
+
+
+def _show_job(name):
+    with _show_lock:
+        job = _show_jobs.get(name)
+        if job is None:
+            return None
+        job = dict(job, errors=list(job['errors'][-10:]))
+    job['elapsed_s'] = round((job.get('finished_at') or time.time()) - job['started_at'], 1)
+    return job
+
+
+@app.route('/shows/<name>/render', methods=['POST'])
+def render_show(name):
+    """Renderiza en segundo plano el guion completo de un show a shows/<name>/.
+    Body: {"scripts": ["texto", {"id": ..., "text": ...}, ...], "voice", "rate", "concurrency"}.
+    Sin "scripts" se reanuda el manifiesto existente o, si no hay (o con "inventario": true),
+    se usa todo el inventario ("usar_adaptaciones": false ignora cache/adaptaciones_inventario.json).
+    Autor: Ing. Walter Rodríguez - 2026-10-18"""
+    if not _SHOW_NAME_RE.match(name):
+        return jsonify({"status": "error", "message": "Nombre de show inválido (letras, números, - y _)"}), 400
+    data = request.get_json(silent=True) or {}
+    try:
+        concurrency = max(1, min(int(data.get('concurrency', SHOW_RENDER_CONCURRENCY)), 16))
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "concurrency debe ser un número"}), 400
+
+    anterior = _leer_manifest_show(name)
+    scripts = data.get('scripts')
+    if scripts is not None:
+        if not isinstance(scripts, list):
+            return jsonify({"status": "error", "message": "scripts debe ser una lista"}), 400
+        guiones = []
+        for i, s in enumerate(scripts):
+            guion = {"id": s.get('id'), "text": s.get('text', '')} if isinstance(s, dict) else {"id": None, "text": s}
+            if not isinstance(guion['text'], str) or not guion['text'].strip():
+                return jsonify({"status": "error", "message": f"El guion {i} está vacío"}), 400
+            guiones.append(guion)
+    elif anterior and not data.get('inventario'):
+        guiones = [{"id": item.get('id'), "text": item['text']} for item in anterior['items']]
+    else:
+        try:
+            guiones = _guiones_inventario(data.get('usar_adaptaciones', True))
+        except FileNotFoundError:
+            return jsonify({"status": "error", "message": "No se encontró Inventario/Inventario.xlsx"}), 404
+    if not guiones:
+        return jsonify({"status": "error", "message": "No hay guiones para renderizar"}), 400
+    default_voice, default_rate = 'es-DO-RamonaNeural', '+0%'
+    if anterior and scripts is None:
+        default_voice, default_rate = anterior.get('voice', default_voice), anterior.get('rate', default_rate)
+    voice = data.get('voice', default_voice)
+    rate = data.get('rate', default_rate)
+
+    with _show_lock:
+        job = _show_jobs.get(name)
+        if job is None or job['state'] != 'running':
+            job = {"state": 'running', "total": 0, "done": 0, "skipped": 0, "failed": 0,
+                   "errors": [], "started_at": time.time()}
+            _show_jobs[name] = job
+            manifest = _plan_show(name, guiones, voice, rate)
+            threading.Thread(target=_run_show_render, name=f'show-{name}', daemon=True,
+                             args=(name, manifest, job, concurrency)).start()
+    return jsonify({"status": "ok", "name": name, **_show_job(name)})
+
+
+@app.route('/shows', methods=['GET'])
+def list_shows():
+    """Shows renderizados en disco con su progreso."""
+    shows = []
+    if os.path.isdir(SHOWS_DIR):
+        for name in sorted(os.listdir(SHOWS_DIR)):
+            manifest = _leer_manifest_show(name)
+            if manifest is None:
+                continue
+            segmentos = [seg for item in manifest['items'] for seg in item['segments']]
+            shows.append({
+                "name": name,
+                "state": manifest.get('state'),
+                "voice": manifest.get('voice'),
+                "items": len(manifest['items']),
+                "segments": len(segmentos),
+                "done": sum(1 for seg in segmentos if seg.get('state') == 'done'),
+                "rendered_at": manifest.get('rendered_at'),
+            })
+    return jsonify({"status": "ok", "shows": shows})
+
+
+@app.route('/shows/<name>', methods=['GET'])
+def get_show(name):
+    """Manifiesto del show (guiones, oraciones, audio y tiempos) y progreso del render."""
+    manifest = _leer_manifest_show(name) if _SHOW_NAME_RE.match(name) else None
+    job = _show_job(name)
+    if manifest is None and job is None:
+        return jsonify({"status": "error", "message": f"Show {name} no encontrado"}), 404
+    return jsonify({"status": "ok", "manifest": manifest, "job": job})
+
+
+@app.route('/shows/<name>/<path:filename>')
+def serve_show_file(name, filename):
+    if not _SHOW_NAME_RE.match(name):
+        abort(404)
+    return send_media(_show_dir(name), filename)
+
+
+# ======== Estado del show en vivo (eventos SSE para overlays y monitores) ========
+# Autor: Ing. Walter Rodríguez - 2026-10-18
+# La ventana del avatar publica en POST /show/state cada cambio (artículo, multimedia,
+# audio listo) y cualquier número de visores (overlay de OBS, monitor del productor) lo
+# recibe por GET /show/events sin sondear la API. Cada evento se codifica una sola vez;
+# los visores duermen en una Condition y solo copian las tramas nuevas.
+# Con waitress cada visor conectado ocupa un hilo del servidor mientras siga abierto: el pool
+# se crea con SERVER_THREADS + SHOW_EVENTS_MAX_SUBSCRIBERS hilos para que los overlays no
+# le quiten hilos a la API. Pasado el máximo, /show/events responde 503 y el visor reintenta.
+SHOW_EVENT_TYPES = ('item', 'media', 'speech')
+SHOW_EVENTS_BUFFER = int(os.getenv('SHOW_EVENTS_BUFFER', '256'))
+SHOW_EVENTS_HEARTBEAT = float(os.getenv('SHOW_EVENTS_HEARTBEAT', '15'))
+SHOW_EVENTS_MAX_SUBSCRIBERS = max(1, int(os.getenv('SHOW_EVENTS_MAX_SUBSCRIBERS', '8')))
+SERVER_POOL_THREADS = SERVER_THREADS + SHOW_EVENTS_MAX_SUBSCRIBERS
+SHOW_EVENT_MAX_BYTES = 64 * 1024
+
+
+def _sse_frame(event_id, event, data):
+    """Trama text/event-stream ya codificada (JSON en una sola línea de data)."""
+    payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    return f"id: {event_id}\nevent: {event}\ndata: {payload}\n\n".encode('utf-8')
+
+
+class ShowState:
+    """Estado actual del show más un búfer circular con los últimos eventos ya codificados.
+    Los ids son consecutivos: un visor que se reconecta con Last-Event-ID recibe lo que se
+    perdió si sigue en el búfer; si no, recibe el estado completo (evento snapshot)."""
+
+    def __init__(self, buffer_size, max_subscribers):
+        self.max_subscribers = max_subscribers
+        self._state = {"item": None, "media": None, "speech": None}
+        self._updated_at = None
+        self._seq = 0
+        self._events = deque(maxlen=buffer_size)  # (id, trama)
+        self._subscribers = 0
+        self._cond = threading.Condition()
+
+    def snapshot(self):
+        with self._cond:
+            return self._snapshot()
+
+    def _snapshot(self):
+        return {"seq": self._seq, "updated_at": self._updated_at, **self._state}
+
+    def publish(self, event, data):
+        """Actualiza el estado y despierta a todos los visores. Un artículo nuevo
+        deja vacíos multimedia y audio hasta que lleguen los suyos."""
+        with self._cond:
+            self._seq += 1
+            self._updated_at = datetime.datetime.now().isoformat(timespec='seconds')
+            if event == 'item':
+                self._state.update(item=data, media=None, speech=None)
+            else:
+                self._state[event] = data
+            frame = _sse_frame(self._seq, event, {"seq": self._seq, "at": self._updated_at, **data})
+            self._events.append((self._seq, frame))
+            self._cond.notify_all()
+            return self._seq
+
+    def subscribe(self):
+        with self._cond:
+            if self._subscribers >= self.max_subscribers:
+                return False
+            self._subscribers += 1
+            return True
+
+    def unsubscribe(self):
+        with self._cond:
+            self._subscribers -= 1
+
+    def frames_after(self, last_id, timeout):
+        """Espera hasta timeout a que haya eventos posteriores a last_id.
+        Devuelve (tramas, nuevo last_id). Si algunos ya salieron del búfer, la única
+        trama es un snapshot con el estado completo."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > last_id, timeout)
+            if self._seq <= last_id:
+                return [], last_id
+            first = self._events[0][0]
+            if last_id < first - 1:
+                return [_sse_frame(self._seq, 'snapshot', self._snapshot())], self._seq
+            frames = [frame for _, frame in itertools.islice(self._events, last_id - first + 1, None)]
+            return frames, self._seq
+
+    def stats(self):
+        with self._cond:
+            return {"seq": self._seq, "subscribers": self._subscribers,
+                    "max_subscribers": self.max_subscribers, "buffered": len(self._events)}
+
+
+show_state = ShowState(SHOW_EVENTS_BUFFER, SHOW_EVENTS_MAX_SUBSCRIBERS)
+metrics.collector('show_events', show_state.stats)
+
+
+@app.route('/show/state', methods=['GET'])
+def get_show_state():
+    """Estado actual del show (artículo, multimedia y audio) y su número de secuencia."""
+    return jsonify({"status": "ok", **show_state.snapshot()})
+
+
+@app.route('/show/state', methods=['POST'])
+def post_show_state():
+    """Publica un cambio del show: {"type": "item"|"media"|"speech", "data": {...}}."""
+    if (request.content_length or 0) > SHOW_EVENT_MAX_BYTES:
+        return jsonify({"status": "error", "message": "Evento demasiado grande"}), 413
+    body = request.get_json(silent=True) or {}
+    event = body.get('type')
+    data = body.get('data')
+    if event not in SHOW_EVENT_TYPES or not isinstance(data, dict):
+        return jsonify({"status": "error",
+                        "message": f"type debe ser uno de {', '.join(SHOW_EVENT_TYPES)} y data un objeto"}), 400
+    return jsonify({"status": "ok", "seq": show_state.publish(event, data)})
+
+
+@app.route('/show/events', methods=['GET'])
+def show_events():
+    """Flujo text/event-stream con los cambios del show. Empieza con un evento snapshot
+    (estado completo) salvo que el visor se reconecte con Last-Event-ID (o ?since=)
+    y lo que se perdió siga en el búfer. Envía un comentario cada SHOW_EVENTS_HEARTBEAT s."""
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        last_id = int(since) if since is not None else None
+    except ValueError:
+        last_id = None
+    if not show_state.subscribe():
+        response = jsonify({"status": "error", "message": f"Máximo de {show_state.max_subscribers} visores conectados"})
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+
+    def generate():
+        yield b"retry: 3000\n\n"
+        cursor = last_id
+        snap = show_state.snapshot()
+        if cursor is None or cursor > snap['seq']:
+            cursor = snap['seq']
+            yield _sse_frame(cursor, 'snapshot', snap)
+        while True:
+            frames, cursor = show_state.frames_after(cursor, SHOW_EVENTS_HEARTBEAT)
+            yield b''.join(frames) if frames else b": ping\n\n"
+
+    response = Response(generate(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(show_state.unsubscribe)
+    return response
+
+
+@app.route('/overlay')
+def overlay():
+    """Overlay para OBS / monitor del productor: sigue el show por /show/events."""
+    return render_template('overlay.html')
+
+
+# ======== Arranque: servidor listo, precarga e informe de tiempos ========
+# Autor: Ing. Walter Rodríguez - 2026-10-18
+# El hilo del servidor activa server_ready en cuanto el socket escucha, así la ventana
+# se abre sin sondear el puerto. Con STARTUP_WARMUP=1 (por defecto), al mostrarse la
+# ventana un hilo precarga el inventario, requests y edge-tts para que la primera
+# petición real no pague esas importaciones.
+STARTUP_WARMUP = os.getenv('STARTUP_WARMUP', '1') == '1'
+STARTUP_READY_TIMEOUT = float(os.getenv('STARTUP_READY_TIMEOUT', '10'))
+_MODULOS_DIFERIDOS = (pd, req_lib, aiohttp, edge_tts, webview)
+
+server_ready = threading.Event()
+_server_error = [None]
+
+
+def _crear_servidor():
+    """Crea el servidor según SERVER_MODE, ya enlazado y escuchando en 127.0.0.1:5000.
+    Devuelve la función que atiende peticiones. Si waitress no está instalado
+    se usa el servidor de desarrollo (con un hilo por petición)."""
+    if SERVER_MODE == 'waitress':
+        try:
+            from waitress.server import create_server
+        except ImportError:
+            print("[SERVIDOR] waitress no está instalado (pip install waitress), usando servidor de desarrollo")
+        else:
+            server = create_server(app, host='127.0.0.1', port=5000, threads=SERVER_POOL_THREADS,
+                                   ident='VentasEnVivo')
+            print(f"[SERVIDOR] waitress en 127.0.0.1:5000 con {SERVER_POOL_THREADS} hilos "
+                  f"({SLOW_ROUTE_MAX} para rutas lentas, {SHOW_EVENTS_MAX_SUBSCRIBERS} para visores SSE)")
+            return server.run
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', 5000, app, threaded=True)
+    print("[SERVIDOR] Servidor de desarrollo en 127.0.0.1:5000")
+    return server.serve_forever
+
+
 def run_flask():
-    app.run(port=5000, debug=False, use_reloader=False)
+    """Arranca el servidor y avisa con server_ready. Las conexiones que lleguen entre el
+    aviso y el bucle de atención esperan en la cola del socket, no se rechazan."""
+    try:
+        atender = _crear_servidor()
+    except (Exception, SystemExit) as e:  # werkzeug hace sys.exit(1) si el puerto está ocupado
+        _server_error[0] = e
+        server_ready.set()
+        raise
+    startup.mark('servidor_listo')
+    server_ready.set()
+    atender()
+
+
+def precargar():
+    """Deja listo en segundo plano lo que la primera petición real va a necesitar.
+    pandas no se importa aquí: el inventario sale de la copia binaria y solo hace
+    falta si el Excel cambió."""
+    pasos = (
+        ('inventario', inventory_index.get),
+        ('requests', req_lib.load),
+        ('edge_tts', edge_tts.load),
+        ('bucle_tts', lambda: tts_worker.loop),
+    )
+    for nombre, paso in pasos:
+        try:
+            paso()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[ARRANQUE] Precarga de {nombre} falló: {e}")
+    startup.mark('precarga_completa')
+    startup.log("Precarga completa")
+
+
+metrics.collector('startup', startup.stats)
+
+
+@app.route('/startup', methods=['GET'])
+def startup_info():
+    """Informe del arranque: marcas en ms desde que empezó a cargarse main.py,
+    duración de cada importación diferida y qué módulos pesados ya están cargados."""
+    return jsonify({"status": "ok", **startup.as_dict(),
+                    "loaded": {m._name: m.loaded for m in _MODULOS_DIFERIDOS}})
+
+
+startup.mark('modulo_cargado')
 
 if __name__ == '__main__':
+    # Necesario en Windows para el pool de procesos de derivados si la app se empaqueta
+    multiprocessing.freeze_support()
+
     # 1. Verificar si ya se está ejecutando (Single Instance Check)
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     try:
@@ -635,22 +3827,12 @@ if __name__ == '__main__':
     print(f"[APP] Pantalla: {screen_w}x{screen_h} → Ventana centrada en ({pos_x},{pos_y})")
 
     # Iniciar Flask en un hilo separado
-    flask_thread = threading.Thread(target=run_flask)
+    flask_thread = threading.Thread(target=run_flask, name='servidor')
     flask_thread.daemon = True
     flask_thread.start()
 
-    # Esperar que Flask esté listo antes de abrir la ventana (evita ventana en blanco)
-    print("[APP] Esperando que Flask esté listo...")
-    for _ in range(40):  # máx 4 segundos
-        try:
-            test = socket.create_connection(("127.0.0.1", 5000), timeout=0.1)
-            test.close()
-            print("[APP] Flask listo ✓")
-            break
-        except OSError:
-            time.sleep(0.1)
-
-    # Crear la ventana sin x/y - se centrara en el evento shown
+    # Crear la ventana sin x/y - se centrara en el evento shown.
+    # pywebview se importa aquí, mientras el servidor arranca en su hilo.
     print("Iniciando aplicación Avatar 3D...")
     window = webview.create_window(
         'Avatar IA - Ing. Walter Rodriguez',
@@ -659,6 +3841,16 @@ if __name__ == '__main__':
         height=win_h,
         min_size=(800, 600)
     )
+    startup.mark('ventana_creada')
+
+    # Esperar que el servidor escuche antes de mostrar la ventana (evita ventana en blanco)
+    if not server_ready.wait(STARTUP_READY_TIMEOUT):
+        print(f"[APP] El servidor no avisó en {STARTUP_READY_TIMEOUT:g} s, se abre la ventana igualmente")
+    elif _server_error[0] is not None:
+        print(f"[APP] No se pudo iniciar el servidor: {_server_error[0]!r}")
+        sys.exit(1)
+    else:
+        print("[APP] Servidor listo ✓")
 
     # Centrar via evento shown: se dispara cuando la ventana ya es visible
     # Esto es más confiable que pasar x/y al constructor (evita bugs de DPI)
@@ -668,12 +3860,17 @@ if __name__ == '__main__':
             print(f"[APP] Ventana movida a ({pos_x}, {pos_y}) ✓")
         except Exception as e:
             print(f"[APP] No se pudo centrar: {e}")
+        startup.mark('ventana_visible')
+        startup.log("Ventana visible")
+        if STARTUP_WARMUP:
+            threading.Thread(target=precargar, name='precarga', daemon=True).start()
 
     # Al cerrar la ventana del avatar, terminar TODO el proceso (Flask + hilo)
     # Esto libera el puerto 5000 y permite reabrir la app sin problemas
     # Autor: Ing. Walter Rodríguez - 2026-02-20
     def al_cerrar():
         print("[APP] Ventana cerrada → terminando proceso completo...")
+        adapt_cache.flush()  # os._exit no ejecuta atexit: guardar las adaptaciones pendientes
         os._exit(0)  # Termina proceso completo incluyendo hilo Flask
 
     window.events.shown  += mover_al_centro
@@ -0,0 +1,29 @@
+# Autor: Ing. Walter Rodríguez
+# Fecha: 2026-10-18
+# Descripción: /metrics no falla cuando una misma métrica mezcla etiquetas int y str.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import Metrics
+
+
+def test_status_int_y_str_en_el_mismo_modelo():
+    m = Metrics('test', (100, 1000))
+    m.inc('gemini_requests_total', model='gemini-2.0-flash', status=200)
+    m.inc('gemini_requests_total', model='gemini-2.0-flash', status='error')
+    m.observe('gemini_duration_ms', 50, model='gemini-2.0-flash', status=429)
+    m.observe('gemini_duration_ms', 900, model='gemini-2.0-flash', status='error')
+    texto = m.as_prometheus()
+    assert 'test_gemini_requests_total{model="gemini-2.0-flash",status="200"} 1' in texto
+    assert 'test_gemini_requests_total{model="gemini-2.0-flash",status="error"} 1' in texto
+    assert 'test_gemini_duration_ms_count{model="gemini-2.0-flash",status="429"} 1' in texto
+
+
+def test_misma_etiqueta_int_y_str_es_una_sola_serie():
+    m = Metrics('test', (100,))
+    m.inc('http_requests_total', status=200)
+    m.inc('http_requests_total', status='200')
+    assert m.as_json()["counters"] == [{"name": "http_requests_total", "labels": {"status": "200"}, "value": 2}]
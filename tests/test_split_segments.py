@@ -0,0 +1,25 @@
+# Autor: Ing. Walter Rodríguez
+# Fecha: 2026-10-18
+# Descripción: split_segments solo trata como emoción las etiquetas de /adaptar.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import split_segments
+
+
+def test_parentesis_del_producto_no_son_emociones():
+    texto = "(feliz) Hola amigos. Hoy vendemos algo (talla M) genial! (serio) Ojo."
+    assert split_segments(texto) == [
+        {"text": "Hola amigos.", "emotion": "feliz"},
+        {"text": "Hoy vendemos algo (talla M) genial!", "emotion": None},
+        {"text": "Ojo.", "emotion": "serio"},
+    ]
+
+
+def test_etiquetas_con_mayusculas_y_espacios():
+    assert split_segments("( Sorpresa ) Llegó el vestido (100% algodón).") == [
+        {"text": "Llegó el vestido (100% algodón).", "emotion": "sorpresa"},
+    ]